@@ -0,0 +1,303 @@
+import hashlib
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+TREE_PATH = re.compile(r'^/repos/([^/]+)/([^/]+)/git/trees/(\d+)_to_(\d+)$')
+RAW_PATH = re.compile(r'^/([^/]+)/([^/]+)/refs/heads/([^/]+)/(.+\.jpg)$')
+
+class StubConfig:
+    """Behaviour of the stub endpoints, configured from BENCH_* environment variables"""
+
+    def __init__(self, hit_ratio: float = 0.3, latency_ms: float = 50.0, jitter_ms: float = 20.0,
+                 min_bytes: int = 20_000, max_bytes: int = 200_000, rate_429: float = 0.0,
+                 rate_5xx: float = 0.0, images_per_branch: int = 200):
+        self.hit_ratio = hit_ratio
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.min_bytes = min_bytes
+        self.max_bytes = max_bytes
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.images_per_branch = images_per_branch
+
+    @classmethod
+    def from_env(cls) -> 'StubConfig':
+        return cls(
+            hit_ratio=float(os.environ.get('BENCH_HIT_RATIO', 0.3)),
+            latency_ms=float(os.environ.get('BENCH_LATENCY_MS', 50.0)),
+            jitter_ms=float(os.environ.get('BENCH_JITTER_MS', 20.0)),
+            min_bytes=int(os.environ.get('BENCH_MIN_BYTES', 20_000)),
+            max_bytes=int(os.environ.get('BENCH_MAX_BYTES', 200_000)),
+            rate_429=float(os.environ.get('BENCH_RATE_429', 0.0)),
+            rate_5xx=float(os.environ.get('BENCH_RATE_5XX', 0.0)),
+            images_per_branch=int(os.environ.get('BENCH_IMAGES_PER_BRANCH', 200)),
+        )
+
+def _fraction(key: str) -> float:
+    """Stable value in [0, 1) per key, so hits do not change between runs"""
+    return int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], 'big') / 2 ** 64
+
+def fake_jpeg(key: str, config: StubConfig) -> bytes:
+    size = config.min_bytes + int(_fraction('size:' + key) * (config.max_bytes - config.min_bytes + 1))
+    # SOI plus an APP0 marker, which is what the probe's magic check expects
+    return b'\xff\xd8\xff\xe0' + random.Random(key).randbytes(max(0, size - 6)) + b'\xff\xd9'
+
+class StubStats:
+    """Per-request service times and bytes sent, reset before each benchmark run"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.latencies: List[float] = []
+            self.bytes_sent = 0
+            self.statuses: Dict[int, int] = {}
+
+    def record(self, latency: float, size: int, status: int):
+        with self.lock:
+            self.latencies.append(latency)
+            self.bytes_sent += size
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Stand-in for fgo.vn /tai-anh-ve/, the GitHub trees API and raw.githubusercontent.com"""
+
+    protocol_version = 'HTTP/1.1'
+    config: StubConfig = None
+    stats: StubStats = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes = b'', headers: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+        return len(body) if self.command != 'HEAD' else 0
+
+    def _inject_error(self) -> Optional[Tuple[int, int]]:
+        roll = random.random()
+        if roll < self.config.rate_429:
+            return 429, self._send(429, b'Too Many Requests', {'Retry-After': '1', 'Content-Type': 'text/plain'})
+        if roll < self.config.rate_429 + self.config.rate_5xx:
+            return 503, self._send(503, b'Service Unavailable', {'Content-Type': 'text/plain'})
+        return None
+
+    def _handle(self):
+        started = time.perf_counter()
+        config = self.config
+        delay = max(0.0, config.latency_ms + random.uniform(-config.jitter_ms, config.jitter_ms)) / 1000
+        time.sleep(delay)
+
+        url = urlparse(self.path)
+        status, sent = self._route(url)
+        self.stats.record(time.perf_counter() - started, sent, status)
+
+    def _route(self, url):
+        error = self._inject_error()
+        if error:
+            return error
+
+        if url.path.rstrip('/') == '/tai-anh-ve':
+            code = parse_qs(url.query).get('id', [''])[0].lower()
+            if _fraction('hit:' + code) < self.config.hit_ratio:
+                body = fake_jpeg(code, self.config)
+                return 200, self._send(200, body, {'Content-Type': 'image/jpeg'})
+            body = 'Mã hình ảnh không đúng!'.encode()
+            return 200, self._send(200, body, {'Content-Type': 'text/html; charset=utf-8'})
+
+        match = TREE_PATH.match(url.path)
+        if match:
+            start, end = int(match.group(3)), int(match.group(4))
+            branch = f"{start}_to_{end}"
+            etag = f'"{hashlib.sha1(branch.encode()).hexdigest()}"'
+            if self.headers.get('If-None-Match') == etag:
+                return 304, self._send(304, b'', {'ETag': etag})
+            folder = f"images_a_20240101_{branch}"
+            count = min(self.config.images_per_branch, end - start + 1)
+            tree = [{'path': folder, 'type': 'tree'}] + [
+                {'path': f"{folder}/a{number}.jpg", 'type': 'blob'} for number in range(start, start + count)
+            ]
+            body = json.dumps({'sha': etag.strip('"'), 'tree': tree}).encode()
+            return 200, self._send(200, body, {'Content-Type': 'application/json', 'ETag': etag})
+
+        match = RAW_PATH.match(url.path)
+        if match:
+            body = fake_jpeg(match.group(4), self.config)
+            return 200, self._send(200, body, {'Content-Type': 'image/jpeg'})
+
+        return 404, self._send(404, b'Not Found', {'Content-Type': 'text/plain'})
+
+    def do_GET(self):
+        self._handle()
+
+    def do_HEAD(self):
+        self._handle()
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients close streamed responses after the first chunk; that is not a server error
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+def start_stub(config: StubConfig, port: int = 0):
+    """Serve the stub endpoints on a background thread; returns (server, stats, base_url)"""
+    stats = StubStats()
+    handler = type('BoundStubHandler', (StubHandler,), {'config': config, 'stats': stats})
+    server = StubServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats, f"http://127.0.0.1:{server.server_address[1]}"
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def run_client(command: List[str], env: Dict[str, str], cwd: str) -> Dict:
+    """Run one script to completion and return its wall time, exit code and peak RSS"""
+    with tempfile.TemporaryFile() as stderr_file:
+        started = time.perf_counter()
+        process = subprocess.Popen(command, env=env, cwd=cwd, stdout=subprocess.DEVNULL, stderr=stderr_file)
+        # wait4 reports the rusage of this child alone, unlike RUSAGE_CHILDREN
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        stderr_file.seek(0)
+        stderr = stderr_file.read().decode(errors='replace')
+    return {
+        'elapsed': time.perf_counter() - started,
+        'exit_code': process.returncode,
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': usage.ru_maxrss / 1024,
+        'stderr': stderr[-500:],
+    }
+
+def client_command(script: str, workdir: str, codes: int) -> List[str]:
+    if script == 'crawler':
+        return [sys.executable, os.path.join(SCRIPTS_DIR, 'crawler_images.py'), 'a', '1', str(codes),
+                os.path.join(workdir, 'images')]
+    if script == 'check':
+        return [sys.executable, os.path.join(SCRIPTS_DIR, 'check_valid_codes.py'), 'a', '1', str(codes),
+                os.path.join(workdir, 'valid_codes', 'a.log')]
+    if script == 'branches':
+        return [sys.executable, os.path.abspath(__file__), 'branches-client', str(codes)]
+    raise ValueError(f"Unknown script: {script}")
+
+def branches_client(codes: int):
+    """Drive fetch_branch_images over synthetic branches, bypassing git and the snapshot store"""
+    sys.path.insert(0, SCRIPTS_DIR)
+    from concurrent.futures import ThreadPoolExecutor
+    from functools import partial
+    from fetch_engine import FetchEngine
+    from fetch_branch_images import process_branch_images
+
+    size = int(os.environ.get('BENCH_BRANCH_SIZE', 1000))
+    branches = [{'branch': f"{start}_to_{start + size - 1}", 'start': start, 'end': start + size - 1, 'sha': None}
+                for start in range(1, codes + 1, size)]
+    with FetchEngine.from_env() as engine:
+        process = partial(process_branch_images, repo_owner='bench', repo_name='images',
+                          failed_branches_file=os.devnull, engine=engine)
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            results = list(executor.map(process, branches))
+    print(f"{sum(len(r) for r in results)} images")
+
+def benchmark(scripts: List[str], levels: List[int], codes: int, config: StubConfig) -> List[Dict]:
+    server, stats, base_url = start_stub(config)
+    results = []
+    try:
+        for script in scripts:
+            for concurrency in levels:
+                with tempfile.TemporaryDirectory() as workdir:
+                    env = dict(os.environ,
+                               FGO_BASE_URL=base_url,
+                               GITHUB_API_URL=base_url,
+                               GITHUB_RAW_URL=base_url,
+                               FETCH_CONCURRENCY=str(concurrency),
+                               FETCH_RATE_LIMIT='0',
+                               VERIFY_SAMPLE='all')
+                    # Indexes and stores would turn repeat runs into no-ops
+                    for name in ('CODE_INDEX_FILE', 'DEDUP_INDEX_FILE', 'IMAGE_STORE_DIR', 'IMAGE_PACK_FILE'):
+                        env.pop(name, None)
+
+                    stats.reset()
+                    run = run_client(client_command(script, workdir, codes), env, workdir)
+                    with stats.lock:
+                        latencies = list(stats.latencies)
+                        bytes_sent = stats.bytes_sent
+                        statuses = dict(stats.statuses)
+
+                result = {
+                    'script': script,
+                    'concurrency': concurrency,
+                    'requests': len(latencies),
+                    'req_per_s': round(len(latencies) / run['elapsed'], 1),
+                    'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+                    'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+                    'mb_per_s': round(bytes_sent / run['elapsed'] / 1_000_000, 2),
+                    'peak_rss_mb': round(run['peak_rss_mb'], 1),
+                    'elapsed_s': round(run['elapsed'], 2),
+                    'statuses': statuses,
+                    'exit_code': run['exit_code'],
+                }
+                if run['exit_code'] != 0:
+                    result['stderr'] = run['stderr']
+                results.append(result)
+                print(json.dumps(result), flush=True)
+    finally:
+        server.shutdown()
+    return results
+
+def print_table(results: List[Dict]):
+    columns = ('script', 'concurrency', 'requests', 'req_per_s', 'p50_ms', 'p99_ms', 'mb_per_s', 'peak_rss_mb')
+    print()
+    print(''.join(f"{column:>13}" for column in columns))
+    for result in results:
+        print(''.join(f"{result[column]:>13}" for column in columns))
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == 'branches-client':
+        branches_client(int(sys.argv[2]))
+        sys.exit(0)
+
+    if len(sys.argv) >= 2 and sys.argv[1] == 'serve':
+        # Leave the stub running to point scripts at by hand
+        server, _, base_url = start_stub(StubConfig.from_env(), int(sys.argv[2]) if len(sys.argv) > 2 else 8000)
+        print(f"Stub serving on {base_url}; set FGO_BASE_URL, GITHUB_API_URL and GITHUB_RAW_URL to it")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+        sys.exit(0)
+
+    if len(sys.argv) < 2:
+        print("Usage: python benchmark.py <codes> [crawler|check|branches]...")
+        print("       python benchmark.py serve [port]")
+        print("Concurrency levels come from BENCH_CONCURRENCY (default 1,5,10,20)")
+        sys.exit(1)
+
+    codes = int(sys.argv[1])
+    scripts = sys.argv[2:] or ['crawler', 'check', 'branches']
+    levels = [int(level) for level in os.environ.get('BENCH_CONCURRENCY', '1,5,10,20').split(',')]
+
+    print_table(benchmark(scripts, levels, codes, StubConfig.from_env()))
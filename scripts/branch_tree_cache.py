@@ -0,0 +1,75 @@
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+
+DEFAULT_CACHE_FILE = os.path.join('image_urls', 'branch_tree_cache.json')
+
+class BranchTreeCache:
+    """Per-branch head SHA, tree ETag and .jpg path list kept between runs"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries: Dict[str, Dict] = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.entries = json.load(f)
+        # Snapshot of what the previous run saw, for diffing
+        self.previous = {branch: list(entry['images']) for branch, entry in self.entries.items()}
+
+    def get(self, branch: str) -> Optional[Dict]:
+        with self.lock:
+            return self.entries.get(branch)
+
+    def is_current(self, branch: str, sha: Optional[str]) -> bool:
+        """True when the branch head has not moved since it was cached"""
+        entry = self.get(branch)
+        return bool(sha and entry and entry.get('sha') == sha)
+
+    def etag(self, branch: str) -> Optional[str]:
+        entry = self.get(branch)
+        return entry.get('etag') if entry else None
+
+    def images(self, branch: str) -> List[str]:
+        entry = self.get(branch)
+        return list(entry['images']) if entry else []
+
+    def store(self, branch: str, sha: Optional[str], etag: Optional[str], images: List[str]):
+        with self.lock:
+            self.entries[branch] = {'sha': sha, 'etag': etag, 'images': images}
+
+    def touch(self, branch: str, sha: Optional[str]):
+        """Record a new head SHA for a branch whose tree did not change"""
+        with self.lock:
+            if branch in self.entries and sha:
+                self.entries[branch]['sha'] = sha
+
+    def prune(self, branches: List[str]):
+        """Drop branches that no longer exist on the remote"""
+        keep = set(branches)
+        with self.lock:
+            self.entries = {branch: entry for branch, entry in self.entries.items() if branch in keep}
+
+    def diff(self) -> Dict[str, Dict[str, List[str]]]:
+        """Per-branch images added and removed since the cache was loaded"""
+        with self.lock:
+            current = {branch: entry['images'] for branch, entry in self.entries.items()}
+
+        changes = {}
+        for branch in sorted(set(current) | set(self.previous)):
+            old = set(self.previous.get(branch, []))
+            new = set(current.get(branch, []))
+            if old != new:
+                changes[branch] = {'added': sorted(new - old), 'removed': sorted(old - new)}
+        return changes
+
+    def save(self):
+        with self.lock:
+            data = json.dumps(self.entries, sort_keys=True)
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as f:
+            f.write(data)
+        os.replace(temp_path, self.path)
@@ -0,0 +1,315 @@
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, urlparse
+from snapshot_parser import parse_snapshot
+from snapshot_store import latest_snapshot, latest_urls
+
+IMAGE_URLS_DIR = os.environ.get('IMAGE_URLS_DIR', 'image_urls')
+CATALOG_INDEX_FILE = os.environ.get('CATALOG_INDEX_FILE', os.path.join(IMAGE_URLS_DIR, 'catalog.idx'))
+DEFAULT_PORT = 8766
+
+# Layout: header, one entry per prefix, then per prefix a sorted uint32 number
+# array followed by a parallel uint32 array of location ids, then JSON metadata
+# holding the source snapshot and the (branch, folder) location table.
+MAGIC = b'FGOCAT1\0'
+HEADER = struct.Struct('<8sIIQQ')
+PREFIX_ENTRY = struct.Struct('<cxxxIQ')
+
+# Same code shape as the snapshot parser's code group
+CODE_PATTERN = re.compile(r'([A-Za-z])([0-9]+)')
+# The parser's folder is /{owner}/{repo}/refs/heads/{branch}/{folder}
+FOLDER_PATTERN = re.compile(r'^/[^/]+/[^/]+/refs/heads/([^/]+)/(.+)$')
+
+Location = Tuple[str, str]
+
+def split_folder(folder: str) -> Location:
+    """(branch, folder) of a parsed URL folder path; URLs outside a branch get an empty branch"""
+    match = FOLDER_PATTERN.match(folder)
+    return (match.group(1), match.group(2)) if match else ('', folder.strip('/'))
+
+def _uint32(values: Sequence[int]) -> bytes:
+    data = array('I', values)
+    if sys.byteorder != 'little':
+        data.byteswap()
+    return data.tobytes()
+
+class CatalogIndex:
+    """Read-only index of one snapshot: sorted numbers per prefix plus each code's (branch, folder).
+
+    Built once from the newest snapshot and saved as a flat file. load()
+    memory-maps that file and answers queries from views into it, so startup
+    does not parse the snapshot and range, count and membership queries are
+    a bisect over the mapped numbers.
+    """
+
+    def __init__(self, numbers: Dict[str, Sequence[int]], location_ids: Dict[str, Sequence[int]],
+                 locations: List[Location], source: Optional[str] = None):
+        self.numbers = numbers
+        self.location_ids = location_ids
+        self.locations = locations
+        self.source = source
+        self.map = None
+        self.file = None
+
+    @classmethod
+    def build(cls, urls: List[str], source: Optional[str] = None) -> 'CatalogIndex':
+        parsed = parse_snapshot('\n'.join(urls))
+        parsed.report(source or 'snapshot')
+
+        location_of: Dict[Location, int] = {}
+        by_prefix: Dict[str, Dict[int, int]] = {}
+        for prefix, number, folder in zip(parsed.prefixes, parsed.numbers, parsed.folders):
+            location = split_folder(folder)
+            location_id = location_of.setdefault(location, len(location_of))
+            # A code listed in two branches keeps its first location
+            by_prefix.setdefault(prefix, {}).setdefault(number, location_id)
+
+        numbers, location_ids = {}, {}
+        for prefix, located in by_prefix.items():
+            ordered = sorted(located)
+            numbers[prefix] = array('I', ordered)
+            location_ids[prefix] = array('I', (located[number] for number in ordered))
+        return cls(numbers, location_ids, list(location_of), source)
+
+    def save(self, path: str):
+        prefixes = sorted(self.numbers)
+        meta = json.dumps({'source': self.source, 'locations': self.locations}).encode()
+
+        offset = HEADER.size + PREFIX_ENTRY.size * len(prefixes)
+        entries, arrays = [], []
+        for prefix in prefixes:
+            count = len(self.numbers[prefix])
+            entries.append(PREFIX_ENTRY.pack(prefix.encode('ascii'), count, offset))
+            arrays += [_uint32(self.numbers[prefix]), _uint32(self.location_ids[prefix])]
+            offset += 8 * count
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(prefixes), len(self), offset, len(meta)))
+            f.writelines(entries + arrays)
+            f.write(meta)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'CatalogIndex':
+        """Map a saved index; the number arrays are views into the mapping, not copies"""
+        file = open(path, 'rb')
+        data = view = None
+        try:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, prefix_count, _, meta_offset, meta_length = HEADER.unpack_from(data, 0)
+            if magic != MAGIC:
+                raise ValueError(f"Not a catalog index: {path}")
+
+            view = memoryview(data)
+            numbers, location_ids = {}, {}
+            for position in range(prefix_count):
+                prefix, count, offset = PREFIX_ENTRY.unpack_from(data, HEADER.size + position * PREFIX_ENTRY.size)
+                prefix = prefix.decode('ascii')
+                if offset + 8 * count > meta_offset:
+                    raise ValueError(f"Truncated catalog index: {path}")
+                if sys.byteorder == 'little':
+                    numbers[prefix] = view[offset:offset + 4 * count].cast('I')
+                    location_ids[prefix] = view[offset + 4 * count:offset + 8 * count].cast('I')
+                else:
+                    for target, start in ((numbers, offset), (location_ids, offset + 4 * count)):
+                        values = array('I', view[start:start + 4 * count])
+                        values.byteswap()
+                        target[prefix] = values
+
+            meta = json.loads(bytes(view[meta_offset:meta_offset + meta_length]))
+            index = cls(numbers, location_ids, [tuple(location) for location in meta['locations']], meta['source'])
+        except Exception:
+            # Drop the views first, a mapping with live views cannot be closed
+            view = numbers = location_ids = None
+            if data is not None:
+                data.close()
+            file.close()
+            raise
+        index.map, index.file = data, file
+        return index
+
+    def close(self):
+        if self.map:
+            self.numbers = self.location_ids = {}
+            try:
+                self.map.close()
+            except BufferError:
+                # Views still held by callers keep the mapping alive until they are dropped
+                pass
+            self.file.close()
+            self.map = self.file = None
+
+    def __len__(self) -> int:
+        return sum(len(numbers) for numbers in self.numbers.values())
+
+    def prefixes(self) -> Dict[str, int]:
+        """Number of codes per prefix"""
+        return {prefix: len(numbers) for prefix, numbers in sorted(self.numbers.items())}
+
+    def _bounds(self, prefix: str, start: Optional[int], end: Optional[int]) -> Tuple[int, int]:
+        numbers = self.numbers.get(prefix, ())
+        low = bisect_left(numbers, start) if start is not None else 0
+        high = bisect_right(numbers, end) if end is not None else len(numbers)
+        return low, max(low, high)
+
+    def count(self, prefix: str, start: Optional[int] = None, end: Optional[int] = None) -> int:
+        low, high = self._bounds(prefix, start, end)
+        return high - low
+
+    def range(self, prefix: str, start: Optional[int] = None, end: Optional[int] = None) -> List[int]:
+        """Numbers of the codes with this prefix in [start, end], ascending"""
+        low, high = self._bounds(prefix, start, end)
+        return list(self.numbers[prefix][low:high]) if high > low else []
+
+    def locate(self, code: str) -> Optional[Location]:
+        """(branch, folder) holding a code, or None when the snapshot does not list it"""
+        match = CODE_PATTERN.fullmatch(code.strip())
+        if not match or match.group(1) not in self.numbers:
+            return None
+        prefix, number = match.group(1), int(match.group(2))
+        numbers = self.numbers[prefix]
+        position = bisect_left(numbers, number)
+        if position == len(numbers) or numbers[position] != number:
+            return None
+        return self.locations[self.location_ids[prefix][position]]
+
+    def __contains__(self, code: str) -> bool:
+        return self.locate(code) is not None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def load_or_build(root: str = IMAGE_URLS_DIR, path: str = CATALOG_INDEX_FILE) -> CatalogIndex:
+    """The saved index when it matches the newest snapshot, otherwise one rebuilt and saved"""
+    source = latest_snapshot(root)
+    if os.path.exists(path):
+        try:
+            index = CatalogIndex.load(path)
+        except (OSError, ValueError, KeyError, TypeError, struct.error) as e:
+            # Truncated, corrupt or an older layout; rebuilt below like a stale one
+            print(f"Ignoring unreadable catalog index {path}: {e}", file=sys.stderr)
+        else:
+            if index.source == source:
+                return index
+            index.close()
+
+    if source is None:
+        raise LookupError(f"No snapshot found in {root}")
+    print(f"Building catalog index from {source}", file=sys.stderr)
+    index = CatalogIndex.build(latest_urls(root), source)
+    index.save(path)
+    return index
+
+def _optional_int(query: Dict[str, List[str]], name: str) -> Optional[int]:
+    return int(query[name][0]) if name in query else None
+
+class CatalogHandler(BaseHTTPRequestHandler):
+    """GET /prefixes, /count?prefix=s&start=&end=, /range?prefix=s&start=&end= and /code/{code}"""
+
+    index: CatalogIndex = None
+
+    def _send(self, status: int, payload: Dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        try:
+            if url.path == '/prefixes':
+                self._send(200, self.index.prefixes())
+            elif url.path in ('/count', '/range') and 'prefix' in query:
+                prefix = query['prefix'][0]
+                start, end = _optional_int(query, 'start'), _optional_int(query, 'end')
+                if url.path == '/count':
+                    self._send(200, {'prefix': prefix, 'count': self.index.count(prefix, start, end)})
+                else:
+                    codes = [f"{prefix}{number}" for number in self.index.range(prefix, start, end)]
+                    self._send(200, {'prefix': prefix, 'count': len(codes), 'codes': codes})
+            elif url.path.startswith('/code/'):
+                code = url.path[len('/code/'):]
+                location = self.index.locate(code)
+                if location:
+                    self._send(200, {'code': code, 'branch': location[0], 'folder': location[1]})
+                else:
+                    self._send(404, {'code': code, 'error': 'not in snapshot'})
+            else:
+                self._send(404, {'error': 'unknown query'})
+        except ValueError as e:
+            self._send(400, {'error': str(e)})
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(index: CatalogIndex, port: int = DEFAULT_PORT):
+    handler = type('BoundCatalogHandler', (CatalogHandler,), {'index': index})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    print(f"Serving {len(index)} codes from {index.source} on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def usage():
+    print("Usage: python catalog_index.py build|prefixes")
+    print("       python catalog_index.py count <prefix> [start_code end_code]")
+    print("       python catalog_index.py range <prefix> <start_code> <end_code>")
+    print("       python catalog_index.py has <code>...")
+    print("       python catalog_index.py serve [port]")
+    sys.exit(1)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        usage()
+
+    command, args = sys.argv[1], sys.argv[2:]
+    if command == 'build' and not args:
+        index = CatalogIndex.build(latest_urls(IMAGE_URLS_DIR), latest_snapshot(IMAGE_URLS_DIR))
+        index.save(CATALOG_INDEX_FILE)
+        print(f"Indexed {len(index)} codes in {len(index.locations)} folders into {CATALOG_INDEX_FILE}")
+        sys.exit(0)
+
+    with load_or_build() as index:
+        if command == 'prefixes' and not args:
+            for prefix, count in index.prefixes().items():
+                print(f"{prefix}\t{count}")
+        elif command == 'count' and len(args) in (1, 3):
+            bounds = map(int, args[1:]) if len(args) == 3 else ()
+            print(index.count(args[0], *bounds))
+        elif command == 'range' and len(args) == 3:
+            for number in index.range(args[0], int(args[1]), int(args[2])):
+                print(f"{args[0]}{number}")
+        elif command == 'has' and args:
+            missing = 0
+            for code in args:
+                location = index.locate(code)
+                if location:
+                    print(f"{code}\t{location[0]}\t{location[1]}")
+                else:
+                    print(f"{code}\tmissing")
+                    missing += 1
+            sys.exit(1 if missing else 0)
+        elif command == 'serve' and len(args) <= 1:
+            serve(index, int(args[0]) if args else DEFAULT_PORT)
+        else:
+            usage()
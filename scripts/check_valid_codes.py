@@ -1,61 +1,103 @@
 import os
 import sys
 import requests
-from concurrent.futures import ThreadPoolExecutor
 from functools import partial
-import time
 from datetime import datetime
+from fetch_engine import FetchEngine, TransientError
+from fgo_probe import VALID, INVALID, probe
+from code_index import CodeIndex
+from code_bitmap import CodeBitmap, from_text_log
+from metrics import METRICS
 
-def check_code(code, prefix):
+# Sample every Nth code and scan densely only around hits; 1 scans every code
+PROBE_STRIDE = int(os.environ.get('PROBE_STRIDE', 1))
+
+def check_code(code, prefix, engine, index=None):
     """Check if an image code is valid"""
     code_str = f"{prefix}{code}"
-    url = f"https://fgo.vn/tai-anh-ve/?id={code_str}"
     
     try:
-        # Add delay to prevent rate limiting
-        time.sleep(0.1)
+        # Only the first chunk is read; the status, Content-Type and magic bytes decide validity
+        with METRICS.phase('fetch'):
+            status, response, _, _ = probe(engine, code_str)
+        response.close()
+        METRICS.inc({VALID: 'hits', INVALID: 'misses'}.get(status, 'errors'))
         
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
+        # Transient errors are not recorded so the code is probed again next run
+        if index and status in (VALID, INVALID):
+            index.record(prefix, code, status)
         
-        # Check if the response indicates an invalid code
-        if "Mã hình ảnh không đúng!" in response.text:
+        if status != VALID:
             return None
             
         return code_str
         
-    except requests.RequestException:
+    except TransientError:
+        # Left to the engine, which probes the code again at the end of the run
+        raise
+    except requests.RequestException as e:
+        METRICS.inc('errors')
+        print(f"Request failed for {code_str}: {e}")
         return None
-    except Exception:
+    except Exception as e:
+        METRICS.inc('errors')
+        print(f"Error checking {code_str}: {e}")
         return None
 
-def scan_range(prefix, start_code, end_code, output_file):
-    """Scan a range of codes and log valid ones"""
+def scan_range(prefix, start_code, end_code, output_file, engine, index=None, stride=1):
+    """Scan a range of codes and log valid ones.
+
+    With stride 1 every code is checked. With a larger stride only every
+    stride-th code is sampled first, and each hit queues the codes within
+    stride of it, so dense scanning spreads out from hits and stops where
+    valid codes stop.
+    """
+    # Codes already logged as valid, e.g. by a download crawl, are not probed again
+    unchecked = CodeBitmap.from_range(prefix, start_code, end_code)
+    if os.path.exists(output_file):
+        known = from_text_log(output_file).get(prefix)
+        if known:
+            unchecked = unchecked - known
+            print(f"{len(unchecked)} of {end_code - start_code + 1} codes not yet logged as valid")
     
-    def process_batch(codes):
-        checker = partial(check_code, prefix=prefix)
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            results = executor.map(checker, codes)
-            valid_codes = [code for code in results if code]
-            return valid_codes
+    # Skip codes the index already knows about
+    if index:
+        allowed = set(index.pending(prefix, start_code, end_code))
+        print(f"{len(allowed)} of {end_code - start_code + 1} codes not yet in the index")
+    else:
+        allowed = None
     
-    # Process in smaller batches to manage memory
-    batch_size = 100
-    current_start = start_code
+    def wanted(code):
+        return code in unchecked and (allowed is None or code in allowed)
     
-    while current_start <= end_code:
-        current_end = min(current_start + batch_size, end_code + 1)
-        batch_codes = range(current_start, current_end)
-        
-        valid_codes = process_batch(batch_codes)
-        
-        # Log valid codes
-        if valid_codes:
-            with open(output_file, 'a') as f:
-                for code in valid_codes:
-                    f.write(f"{code}\n")
+    initial = [code for code in range(start_code, end_code + 1, stride) if wanted(code)]
+    checker = partial(check_code, prefix=prefix, engine=engine, index=index)
+    probed = 0
+    found = 0
+    
+    with open(output_file, 'a') as f:
+        def on_result(code, code_str):
+            nonlocal probed, found
+            probed += 1
+            METRICS.advance()
+            if not code_str:
+                return None
+            
+            # Log valid codes as they are found
+            f.write(f"{code_str}\n")
+            f.flush()
+            found += 1
+            
+            if stride > 1:
+                return [near for near in range(code - stride + 1, code + stride) if wanted(near)]
+            return None
         
-        current_start = current_end
+        # Hits enqueue more codes, so the total is only known for a dense scan
+        METRICS.start(len(initial) if stride == 1 else None)
+        engine.feed(checker, initial, on_result)
+        METRICS.finish()
+    
+    print(f"Probed {probed} codes, found {found} valid")
 
 if __name__ == "__main__":
     if len(sys.argv) != 5:
@@ -70,7 +112,13 @@ if __name__ == "__main__":
     # Create or clear the output file
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
     
-    scan_range(prefix, start_code, end_code, output_file)
+    index = CodeIndex.from_env()
+    
+    with FetchEngine.from_env() as engine:
+        scan_range(prefix, start_code, end_code, output_file, engine, index, PROBE_STRIDE)
+    
+    if index:
+        index.close()
 
     # When writing to the log file, use append mode ('a') instead of write mode ('w')
     with open(output_file, 'a') as f:
@@ -0,0 +1,211 @@
+import os
+import re
+import struct
+import sys
+from array import array
+from typing import Dict, Iterable, Iterator, Tuple
+
+MAGIC = b'FGOB'
+VERSION = 1
+
+CONTAINER_BITS = 16
+CONTAINER_SIZE = 1 << CONTAINER_BITS
+LOW_MASK = CONTAINER_SIZE - 1
+# Roaring's cut-over: above this cardinality a bitmap container is smaller than a sorted array
+ARRAY_MAX = 4096
+
+KIND_ARRAY = 0
+KIND_BITMAP = 1
+
+HEADER = struct.Struct('<4sBcH')
+CONTAINER_HEADER = struct.Struct('<HBI')
+
+CODE_PATTERN = re.compile(r'([a-z])(\d+)(?:\.jpg)?$')
+
+def _bits(value: int) -> Iterator[int]:
+    """Positions of the set bits of a container, ascending"""
+    data = value.to_bytes((value.bit_length() + 7) // 8, 'little')
+    for byte_index, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            yield byte_index * 8 + low.bit_length() - 1
+            byte ^= low
+
+class CodeBitmap:
+    """Roaring-style bitset of code numbers for one prefix.
+
+    Numbers are split into 16-bit containers keyed by their high bits. Each
+    container is held as a Python int bitset in memory and serialized either
+    as a sorted uint16 array or as a raw 8 KB bitmap, whichever is smaller.
+    """
+
+    def __init__(self, prefix: str, numbers: Iterable[int] = ()):
+        self.prefix = prefix
+        self.containers: Dict[int, int] = {}
+        for number in numbers:
+            self.add(number)
+
+    def add(self, number: int):
+        key = number >> CONTAINER_BITS
+        self.containers[key] = self.containers.get(key, 0) | (1 << (number & LOW_MASK))
+
+    def contains(self, number: int) -> bool:
+        container = self.containers.get(number >> CONTAINER_BITS, 0)
+        return bool((container >> (number & LOW_MASK)) & 1)
+
+    __contains__ = contains
+
+    def __len__(self) -> int:
+        return sum(bin(container).count('1') for container in self.containers.values())
+
+    def __iter__(self) -> Iterator[int]:
+        for key in sorted(self.containers):
+            base = key << CONTAINER_BITS
+            for low in _bits(self.containers[key]):
+                yield base + low
+
+    def __eq__(self, other) -> bool:
+        return (isinstance(other, CodeBitmap) and self.prefix == other.prefix
+                and self.containers == other.containers)
+
+    def ranges(self) -> Iterator[Tuple[int, int]]:
+        """Yield (start, end) inclusive runs of consecutive numbers"""
+        start = end = None
+        for number in self:
+            if end is not None and number == end + 1:
+                end = number
+                continue
+            if start is not None:
+                yield start, end
+            start = end = number
+        if start is not None:
+            yield start, end
+
+    def union(self, other: 'CodeBitmap') -> 'CodeBitmap':
+        result = CodeBitmap(self.prefix)
+        result.containers = dict(self.containers)
+        for key, container in other.containers.items():
+            result.containers[key] = result.containers.get(key, 0) | container
+        return result
+
+    def difference(self, other: 'CodeBitmap') -> 'CodeBitmap':
+        result = CodeBitmap(self.prefix)
+        for key, container in self.containers.items():
+            remaining = container & ~other.containers.get(key, 0)
+            if remaining:
+                result.containers[key] = remaining
+        return result
+
+    __or__ = union
+    __sub__ = difference
+
+    @classmethod
+    def from_range(cls, prefix: str, start: int, end: int) -> 'CodeBitmap':
+        """Bitmap holding every number in [start, end], e.g. to compute unchecked codes"""
+        bitmap = cls(prefix)
+        for key in range(start >> CONTAINER_BITS, (end >> CONTAINER_BITS) + 1):
+            low = max(start, key << CONTAINER_BITS) & LOW_MASK
+            high = min(end, (key << CONTAINER_BITS) | LOW_MASK) & LOW_MASK
+            bitmap.containers[key] = ((1 << (high - low + 1)) - 1) << low
+        return bitmap
+
+    def serialize(self) -> bytes:
+        keys = sorted(key for key, container in self.containers.items() if container)
+        parts = [HEADER.pack(MAGIC, VERSION, self.prefix.encode('ascii'), len(keys))]
+
+        for key in keys:
+            container = self.containers[key]
+            cardinality = bin(container).count('1')
+            if cardinality <= ARRAY_MAX:
+                parts.append(CONTAINER_HEADER.pack(key, KIND_ARRAY, cardinality))
+                values = array('H', _bits(container))
+                if sys.byteorder != 'little':
+                    values.byteswap()
+                parts.append(values.tobytes())
+            else:
+                parts.append(CONTAINER_HEADER.pack(key, KIND_BITMAP, cardinality))
+                parts.append(container.to_bytes(CONTAINER_SIZE // 8, 'little'))
+
+        return b''.join(parts)
+
+    @classmethod
+    def deserialize(cls, data: bytes) -> 'CodeBitmap':
+        magic, version, prefix, count = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a code bitmap file")
+
+        bitmap = cls(prefix.decode('ascii'))
+        offset = HEADER.size
+        for _ in range(count):
+            key, kind, cardinality = CONTAINER_HEADER.unpack_from(data, offset)
+            offset += CONTAINER_HEADER.size
+
+            if kind == KIND_ARRAY:
+                values = array('H')
+                values.frombytes(data[offset:offset + cardinality * 2])
+                if sys.byteorder != 'little':
+                    values.byteswap()
+                offset += cardinality * 2
+                container = 0
+                for low in values:
+                    container |= 1 << low
+            else:
+                container = int.from_bytes(data[offset:offset + CONTAINER_SIZE // 8], 'little')
+                offset += CONTAINER_SIZE // 8
+
+            bitmap.containers[key] = container
+
+        return bitmap
+
+    def save(self, path: str):
+        with open(path, 'wb') as f:
+            f.write(self.serialize())
+
+    @classmethod
+    def load(cls, path: str) -> 'CodeBitmap':
+        with open(path, 'rb') as f:
+            return cls.deserialize(f.read())
+
+def from_text_log(log_file: str) -> Dict[str, CodeBitmap]:
+    """Read a valid-codes log (or URL snapshot) into one bitmap per prefix"""
+    bitmaps: Dict[str, CodeBitmap] = {}
+    with open(log_file, 'r') as f:
+        for line in f:
+            match = CODE_PATTERN.search(line.strip())
+            if not match:
+                # Scan-completed markers and headers are skipped
+                continue
+            prefix, number = match.group(1), int(match.group(2))
+            if prefix not in bitmaps:
+                bitmaps[prefix] = CodeBitmap(prefix)
+            bitmaps[prefix].add(number)
+    return bitmaps
+
+def to_text_log(bitmaps: Iterable[CodeBitmap], log_file: str):
+    """Write bitmaps back out in the one-code-per-line log format"""
+    with open(log_file, 'w') as f:
+        for bitmap in sorted(bitmaps, key=lambda b: b.prefix):
+            for number in bitmap:
+                f.write(f"{bitmap.prefix}{number}\n")
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] not in ('encode', 'decode'):
+        print("Usage: python code_bitmap.py encode <log_file> <output_dir>")
+        print("       python code_bitmap.py decode <bitmap_dir> <log_file>")
+        sys.exit(1)
+
+    if sys.argv[1] == 'encode':
+        output_dir = sys.argv[3]
+        os.makedirs(output_dir, exist_ok=True)
+        for prefix, bitmap in from_text_log(sys.argv[2]).items():
+            path = os.path.join(output_dir, f"valid_codes_{prefix}.bitmap")
+            # Merge into any existing bitmap for the prefix
+            if os.path.exists(path):
+                bitmap = CodeBitmap.load(path) | bitmap
+            bitmap.save(path)
+            print(f"{path}: {len(bitmap)} codes")
+    else:
+        bitmap_dir = sys.argv[2]
+        bitmaps = [CodeBitmap.load(os.path.join(bitmap_dir, name))
+                   for name in sorted(os.listdir(bitmap_dir)) if name.endswith('.bitmap')]
+        to_text_log(bitmaps, sys.argv[3])
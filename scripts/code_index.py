@@ -0,0 +1,160 @@
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+from glob import glob
+from typing import Iterable, List, Optional, Tuple
+from snapshot_store import latest_urls
+
+VALID = 'valid'
+INVALID = 'invalid'
+DOWNLOADED = 'downloaded'
+
+DEFAULT_INVALID_TTL_DAYS = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS codes (
+    prefix TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    checked_at REAL NOT NULL,
+    PRIMARY KEY (prefix, number)
+) WITHOUT ROWID
+"""
+
+# A code never moves back from downloaded to valid, or from either to invalid
+UPSERT = """
+INSERT INTO codes (prefix, number, status, checked_at) VALUES (?, ?, ?, ?)
+ON CONFLICT (prefix, number) DO UPDATE SET
+    status = CASE
+        WHEN codes.status = 'downloaded' THEN codes.status
+        WHEN codes.status = 'valid' AND excluded.status = 'invalid' THEN codes.status
+        ELSE excluded.status
+    END,
+    checked_at = MAX(codes.checked_at, excluded.checked_at)
+"""
+
+CODE_PATTERN = re.compile(r'([a-z])(\d+)')
+IMAGE_URL_PATTERN = re.compile(r'/([a-z])(\d+)\.jpg$')
+EMPTY_RANGE_PATTERN = re.compile(
+    r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) - No images found in range (\d+) to (\d+) with prefix ([a-z])'
+)
+
+class CodeIndex:
+    """On-disk status index of codes keyed by (prefix, number)"""
+
+    def __init__(self, path: str, invalid_ttl_days: float = DEFAULT_INVALID_TTL_DAYS):
+        self.path = path
+        self.invalid_ttl = invalid_ttl_days * 86400
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(SCHEMA)
+        self.conn.commit()
+
+    @classmethod
+    def from_env(cls) -> Optional['CodeIndex']:
+        """Open the index named by CODE_INDEX_FILE, or return None when it is not configured"""
+        path = os.environ.get('CODE_INDEX_FILE')
+        if not path:
+            return None
+        ttl = float(os.environ.get('CODE_INDEX_INVALID_TTL_DAYS', DEFAULT_INVALID_TTL_DAYS))
+        return cls(path, ttl)
+
+    def record(self, prefix: str, number: int, status: str, checked_at: Optional[float] = None):
+        """Record the status of a single code"""
+        self.record_many([(prefix, number, status)], checked_at)
+
+    def record_many(self, entries: Iterable[Tuple[str, int, str]], checked_at: Optional[float] = None):
+        """Record (prefix, number, status) entries in one transaction"""
+        checked_at = checked_at if checked_at is not None else time.time()
+        rows = [(prefix, number, status, checked_at) for prefix, number, status in entries]
+        with self.lock:
+            self.conn.executemany(UPSERT, rows)
+            self.conn.commit()
+
+    def status(self, prefix: str, number: int) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT status FROM codes WHERE prefix = ? AND number = ?", (prefix, number)
+            ).fetchone()
+        return row[0] if row else None
+
+    def pending(self, prefix: str, start: int, end: int, skip: Iterable[str] = (VALID, DOWNLOADED)) -> List[int]:
+        """Numbers in [start, end] that still need probing.
+
+        Codes whose status is in skip are left out, as are invalid codes checked
+        within the re-check TTL.
+        """
+        skip = set(skip)
+        expiry = time.time() - self.invalid_ttl
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT number, status, checked_at FROM codes WHERE prefix = ? AND number BETWEEN ? AND ?",
+                (prefix, start, end)
+            ).fetchall()
+
+        known = set()
+        for number, status, checked_at in rows:
+            if status in skip or (status == INVALID and checked_at > expiry):
+                known.add(number)
+
+        return [number for number in range(start, end + 1) if number not in known]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def _parse_timestamp(value: str) -> float:
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S').timestamp()
+
+def seed_from_logs(index: CodeIndex, root: str = '.'):
+    """Seed the index from valid_codes/*.log, the newest image URL snapshot and empty_ranges.log"""
+    valid = []
+    for log_file in glob(os.path.join(root, 'valid_codes', '*.log')):
+        with open(log_file, 'r') as f:
+            for line in f:
+                match = CODE_PATTERN.fullmatch(line.strip())
+                if match:
+                    valid.append((match.group(1), int(match.group(2)), VALID))
+    index.record_many(valid)
+
+    downloaded = []
+    for url in latest_urls(os.path.join(root, 'image_urls')):
+        match = IMAGE_URL_PATTERN.search(url)
+        if match:
+            downloaded.append((match.group(1), int(match.group(2)), DOWNLOADED))
+    index.record_many(downloaded)
+
+    empty_log = os.path.join(root, 'empty_ranges.log')
+    invalid = 0
+    if os.path.exists(empty_log):
+        with open(empty_log, 'r') as f:
+            for line in f:
+                match = EMPTY_RANGE_PATTERN.match(line)
+                if not match:
+                    continue
+                timestamp, start, end, prefix = match.groups()
+                entries = [(prefix, number, INVALID) for number in range(int(start), int(end) + 1)]
+                index.record_many(entries, _parse_timestamp(timestamp))
+                invalid += len(entries)
+
+    print(f"Seeded index: {len(valid)} valid, {len(downloaded)} downloaded, {invalid} invalid")
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python code_index.py <index_file>")
+        sys.exit(1)
+
+    with CodeIndex(sys.argv[1]) as index:
+        seed_from_logs(index)
@@ -3,67 +3,226 @@ import requests
 import datetime
 import sys
 import json
-from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import tempfile
 from functools import partial
-from io import BytesIO
-from PIL import Image
+from itertools import chain
+from fetch_engine import FetchEngine, TransientError
+from fgo_probe import VALID, INVALID, MAGIC_SIZE, image_trailer, probe, log_valid_code
+from code_index import CodeIndex, DOWNLOADED
+from image_dedup import DedupIndex, store_as_reference
+from image_store import ImageStore, branch_for_folder
+from pack_file import PackWriter
+from image_derivatives import DerivativeStage
+from metrics import METRICS
+
+# Responses larger than this are abandoned mid-stream
+MAX_IMAGE_BYTES = int(os.environ.get('MAX_IMAGE_BYTES', 20 * 1024 * 1024))
+
+# Encoders sometimes pad after the closing marker, so look for it in a short tail window
+TAIL_SIZE = 64
+
+class ImageTooLarge(Exception):
+    pass
+
+class StreamValidator:
+    """Validate image framing incrementally as chunks arrive, hashing the bytes on the way.
+
+    Accepts the same formats the probe classifies as valid: the magic bytes
+    pick the format, whose closing marker must then appear in the tail.
+    """
+
+    def __init__(self, max_bytes=MAX_IMAGE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        self.head = b''
+        self.tail = b''
+
+    def feed(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise ImageTooLarge(f"body exceeds {self.max_bytes} bytes")
+
+        self.sha256.update(chunk)
+
+        if len(self.head) < MAGIC_SIZE:
+            self.head += chunk[:MAGIC_SIZE - len(self.head)]
+        self.tail = (self.tail + chunk[-TAIL_SIZE:])[-TAIL_SIZE:]
+
+    def is_valid(self):
+        trailer = image_trailer(self.head)
+        return trailer is not None and trailer in self.tail
+
+def stream_to_file(head, chunks, target_path, max_bytes=MAX_IMAGE_BYTES):
+    """Write chunks to a temp file next to target_path and rename it into place once validated.
+
+    Returns the SHA-256 hex digest of the stored file, or None if it failed validation.
+    """
+    validator = StreamValidator(max_bytes)
+    folder = os.path.dirname(target_path) or '.'
+    fd, temp_path = tempfile.mkstemp(dir=folder, suffix='.part')
 
-def is_valid_image(content):
     try:
-        img = Image.open(BytesIO(content))
-        img.verify()
-        return True
-    except Exception:
-        return False
+        with os.fdopen(fd, 'wb') as file:
+            for chunk in chain((head,), chunks):
+                validator.feed(chunk)
+                file.write(chunk)
+
+        if not validator.is_valid():
+            os.remove(temp_path)
+            return None
+
+        os.replace(temp_path, target_path)
+        return validator.sha256.hexdigest()
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
 
-def download_image(code, prefix, base_folder):
+def download_image(code, prefix, base_folder, engine, valid_log=None, index=None, dedup=None, store=None, pack=None):
     code_str = f"{prefix}{code}"
-    url = f"https://fgo.vn/tai-anh-ve/?id={code_str}"
+    transient = False
     
     try:
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        content = response.content
+        with METRICS.phase('fetch'):
+            status, response, head, chunks = probe(engine, code_str)
+        url = response.url
+
+        with response:
+            if status != VALID:
+                if status == INVALID:
+                    METRICS.inc('misses')
+                    if index:
+                        index.record(prefix, code, INVALID)
+                else:
+                    METRICS.inc('errors', reason=f"http_{response.status_code}")
+                METRICS.detail(f"Invalid image code for {url}")
+                return False
+
+            content_length = int(response.headers.get('Content-Length') or 0)
+            if content_length > MAX_IMAGE_BYTES:
+                METRICS.inc('errors', reason='too_large')
+                print(f"Image too large ({content_length} bytes) for {url}")
+                return False
+
+            image_path = os.path.join(base_folder, f"{code_str}.jpg")
+            try:
+                with METRICS.phase('write'):
+                    sha = stream_to_file(head, chunks, image_path)
+            except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                # A body cut off mid-stream is worth another try, like a failed request
+                raise TransientError(f"{url}: {e}") from e
+            if not sha:
+                METRICS.inc('errors', reason='invalid_content')
+                print(f"Invalid image content for {url}")
+                return False
 
-        if not is_valid_image(content):
-            print(f"Invalid image content for {url}")
-            return False
+        METRICS.inc('hits')
+        METRICS.inc('bytes', os.path.getsize(image_path))
 
-        if "Mã hình ảnh không đúng!" in response.text:
-            print(f"Invalid image code for {url}")
-            return False
+        # The store keeps the bytes even when the folder copy becomes a reference
+        if store:
+            store.add_file(code_str, image_path, sha, branch=branch_for_folder(base_folder),
+                           folder=os.path.basename(os.path.normpath(base_folder)))
 
-        image_path = os.path.join(base_folder, f"{code_str}.jpg")
-        
-        with open(image_path, "wb") as file:
-            file.write(content)
+        # Only byte-identical images become references; near matches are just reported
+        ref, near = dedup.register(code_str, image_path, sha) if dedup else (None, None)
+        if near:
+            METRICS.inc('near_duplicates')
+            METRICS.detail(f"{code_str} resembles {near}, kept as is")
+        if ref:
+            image_path = store_as_reference(image_path, ref, sha)
+            METRICS.inc('duplicates')
+            METRICS.detail(f"Duplicate of {ref}, stored reference: {image_path}")
+        elif pack:
+            # One pack file per batch instead of thousands of loose files
+            pack.add_file(code_str, image_path, sha)
+            os.remove(image_path)
+            image_path = f"{pack.pack_path}:{code_str}"
 
-        print(f"Downloaded and saved: {image_path}")
+        if valid_log:
+            log_valid_code(valid_log, code_str)
+
+        if index:
+            index.record(prefix, code, DOWNLOADED)
+
+        METRICS.detail(f"Downloaded and saved: {image_path}")
         return True
 
+    except TransientError as e:
+        # The engine runs the code again at the end of the run
+        transient = True
+        METRICS.inc('errors', reason='transient')
+        METRICS.detail(f"Deferring {code_str}: {e}")
+        raise
+    except ImageTooLarge as e:
+        METRICS.inc('errors', reason='too_large')
+        print(f"Image too large for {code_str}: {e}")
+        return False
     except requests.RequestException as e:
-        print(f"Failed to download {url}: {e}")
+        METRICS.inc('errors', reason='request')
+        print(f"Failed to download {code_str}: {e}")
         return False
     except Exception as e:
-        print(f"Error processing {url}: {e}")
+        METRICS.inc('errors', reason='exception')
+        print(f"Error processing {code_str}: {e}")
         return False
+    finally:
+        if not transient:
+            METRICS.advance()
 
 if __name__ == "__main__":
-    if len(sys.argv) != 5:
-        print("Usage: python script.py <prefix> <start_code> <end_code> <output_folder>")
+    if len(sys.argv) not in (5, 6):
+        print("Usage: python script.py <prefix> <start_code> <end_code> <output_folder> [valid_codes_log]")
         sys.exit(1)
 
     prefix = sys.argv[1]
     start_code = int(sys.argv[2])
     end_code = int(sys.argv[3])
     output_dir = sys.argv[4]
+    # Optional: record valid codes in the same pass instead of running check_valid_codes.py
+    valid_log = sys.argv[5] if len(sys.argv) == 6 else None
 
     os.makedirs(output_dir, exist_ok=True)
+    if valid_log and os.path.dirname(valid_log):
+        os.makedirs(os.path.dirname(valid_log), exist_ok=True)
+
+    index = CodeIndex.from_env()
+    dedup = DedupIndex.from_env()
+    store = ImageStore.from_env()
+    # Append images to one pack archive instead of leaving loose .jpg files
+    pack_file = os.environ.get('IMAGE_PACK_FILE')
+    pack = PackWriter(pack_file) if pack_file else None
+
+    with FetchEngine.from_env() as engine:
+        if index:
+            # Codes known valid but not yet downloaded are still fetched
+            codes = index.pending(prefix, start_code, end_code, skip=(DOWNLOADED,))
+            print(f"Fetching {len(codes)} of {end_code - start_code + 1} codes not yet in the index")
+        else:
+            codes = range(start_code, end_code + 1)
+        download_with_params = partial(download_image, prefix=prefix, base_folder=output_dir, engine=engine,
+                                       valid_log=valid_log, index=index, dedup=dedup, store=store, pack=pack)
+        METRICS.start(len(codes))
+        results = engine.map(download_with_params, codes)
+
+    if index:
+        index.close()
+    if dedup:
+        dedup.close()
+    if store:
+        store.close()
+    if pack:
+        pack.close()
 
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        codes = range(start_code, end_code + 1)
-        download_with_params = partial(download_image, prefix=prefix, base_folder=output_dir)
-        results = list(executor.map(download_with_params, codes))
+    # Optional: thumbnails and WebP variants, decoded in worker processes off the download threads
+    derivatives = DerivativeStage.from_env()
+    if derivatives:
+        downloaded = [os.path.join(output_dir, f"{prefix}{code}.jpg") for code, ok in zip(codes, results) if ok]
+        # Packed images and dedup references have no loose file to read
+        derivatives.run([path for path in downloaded if os.path.exists(path)])
 
+    METRICS.finish()
     successful = sum(1 for r in results if r)
     print(f"Downloaded {successful} images out of {len(results)} attempts")
@@ -1,102 +1,131 @@
 import os
 import re
-import subprocess
 import requests
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 import sys
 from typing import List, Dict, Optional
-import time
 import random
+from fetch_engine import FetchEngine, TransientError
+from branch_tree_cache import BranchTreeCache, DEFAULT_CACHE_FILE
+from snapshot_store import SnapshotStore, DEFAULT_STORE_DIR
+from metrics import METRICS
+from range_manifest import RangeManifest, RANGE_MANIFEST_FILE, load_ranges
 
-def get_remote_branches() -> List[Dict[str, any]]:
-    """Get list of remote branches with ranges"""
-    try:
-        result = subprocess.run(['git', 'branch', '-r'], capture_output=True, text=True)
-        branches = result.stdout.strip().split('\n')
-        
-        # Extract range information from branch names
-        range_patterns = []
-        for branch in branches:
-            branch = branch.strip()
-            if 'origin/' in branch and '_to_' in branch:
-                # Extract range numbers from branch name
-                match = re.search(r'(\d+)_to_(\d+)$', branch)
-                if match:
-                    start, end = map(int, match.groups())
-                    range_patterns.append({
-                        'start': start,
-                        'end': end,
-                        'branch': branch.replace('origin/', '')
-                    })
-        
-        return range_patterns
-    except subprocess.SubprocessError as e:
-        print(f"Error getting remote branches: {e}")
-        return []
+# Images per branch to HEAD-check; the git tree is otherwise trusted. 'all' checks every image.
+VERIFY_SAMPLE = os.environ.get('VERIFY_SAMPLE', '5')
+BRANCH_CACHE_FILE = os.environ.get('BRANCH_CACHE_FILE', DEFAULT_CACHE_FILE)
+SNAPSHOT_STORE_DIR = os.environ.get('SNAPSHOT_STORE_DIR', DEFAULT_STORE_DIR)
+GITHUB_API_URL = os.environ.get('GITHUB_API_URL', 'https://api.github.com')
+GITHUB_RAW_URL = os.environ.get('GITHUB_RAW_URL', 'https://raw.githubusercontent.com')
 
 def get_image_url(repo_owner: str, repo_name: str, branch: str, folder: str, image_name: str) -> str:
     """Generate GitHub raw content URL for an image"""
-    return f"https://raw.githubusercontent.com/{repo_owner}/{repo_name}/refs/heads/{branch}/{folder}/{image_name}"
+    return f"{GITHUB_RAW_URL}/{repo_owner}/{repo_name}/refs/heads/{branch}/{folder}/{image_name}"
 
-def check_image_exists(url: str) -> bool:
-    """Check if image exists at URL"""
+def check_image_exists(url: str, engine: FetchEngine) -> bool:
+    """Check if image exists at URL; transient failures are left to the engine's retry queue"""
     try:
-        response = requests.head(url, timeout=5)
+        response = engine.head(url, timeout=5)
         return response.status_code == 200
+    except TransientError:
+        raise
     except requests.RequestException:
         return False
 
-def get_branch_contents(repo_owner: str, repo_name: str, branch: str, error_log_file: str) -> List[str]:
-    """Get list of files and folders in a branch using GitHub API with retry logic"""
-    max_retries = 3
-    retry_delay = random.randint(300, 600)  # Random delay between 5-10 minutes
-    
-    for attempt in range(max_retries):
-        try:
-            api_url = f"https://api.github.com/repos/{repo_owner}/{repo_name}/git/trees/{branch}?recursive=1"
-            response = requests.get(api_url)
-            response.raise_for_status()
-            
-            tree = response.json().get('tree', [])
-            return [item['path'] for item in tree if item['type'] == 'blob' and item['path'].endswith('.jpg')]
-            
-        except requests.RequestException as e:
-            error_msg = f"Error fetching branch {branch}: {str(e)}"
-            print(error_msg)
-            
-            # Log the error
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            with open(error_log_file, 'a') as f:
-                f.write(f"{timestamp} - {error_msg}\n")
-            
-            # If rate limited, wait and retry
-            if response.status_code == 403 and 'rate limit exceeded' in str(e):
-                if attempt < max_retries - 1:
-                    print(f"Rate limit exceeded. Waiting {retry_delay} seconds before retry...")
-                    time.sleep(retry_delay)
-                    # Generate new random delay for next attempt
-                    retry_delay = random.randint(300, 600)
-                    continue
-            
-            return []
-    
-    return []
-
-def process_branch_images(branch_info: Dict[str, any], repo_owner: str, repo_name: str, failed_branches_file: str) -> List[str]:
+def verify_images(urls: List[str], engine: FetchEngine, sample: str = VERIFY_SAMPLE) -> List[str]:
+    """Return the URLs that exist, trusting the tree unless a spot-check fails.
+
+    Blobs listed in the branch tree are treated as existing. A random sample is
+    HEAD-checked concurrently; if any sampled URL is missing, every URL in the
+    branch is checked instead. A URL whose check never got an answer (None) is
+    kept, since the tree lists it.
+    """
+    check = partial(check_image_exists, engine=engine)
+    if sample == 'all':
+        return [url for url, ok in zip(urls, engine.map(check, urls)) if ok is not False]
+
+    sample_size = min(int(sample), len(urls))
+    if sample_size <= 0:
+        return urls
+
+    sampled = random.sample(urls, sample_size)
+    if all(ok is not False for ok in engine.map(check, sampled)):
+        return urls
+
+    print(f"Spot-check failed, verifying all {len(urls)} images")
+    return verify_images(urls, engine, 'all')
+
+def get_branch_contents(repo_owner: str, repo_name: str, branch: str, error_log_file: str, engine: FetchEngine,
+                        cache: Optional[BranchTreeCache] = None, sha: Optional[str] = None) -> List[str]:
+    """Get list of files and folders in a branch using the GitHub API.
+
+    When a cache is given the request carries the cached ETag, and a 304 reply
+    returns the cached listing without counting against the rate limit. Rate
+    limits and server errors are retried by the engine; if they persist the
+    TransientError propagates so the branch is retried at the end of the run.
+    """
+    api_url = f"{GITHUB_API_URL}/repos/{repo_owner}/{repo_name}/git/trees/{branch}?recursive=1"
+    headers = {}
+    etag = cache.etag(branch) if cache else None
+    if etag:
+        headers['If-None-Match'] = etag
+    
+    try:
+        response = engine.get(api_url, headers=headers)
+        
+        if response.status_code == 304:
+            cache.touch(branch, sha)
+            return cache.images(branch)
+        
+        response.raise_for_status()
+        
+        tree = response.json().get('tree', [])
+        # Thumbnails published under each folder's derivatives/ are not catalogued as images
+        images = [item['path'] for item in tree if item['type'] == 'blob' and item['path'].endswith('.jpg')
+                  and '/derivatives/' not in item['path']]
+        
+        if cache:
+            cache.store(branch, sha, response.headers.get('ETag'), images)
+        
+        return images
+        
+    except requests.RequestException as e:
+        error_msg = f"Error fetching branch {branch}: {str(e)}"
+        print(error_msg)
+        
+        # Log the error
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with open(error_log_file, 'a') as f:
+            f.write(f"{timestamp} - {error_msg}\n")
+        
+        if isinstance(e, TransientError):
+            raise
+        return []
+
+def process_branch_images(branch_info: Dict[str, any], repo_owner: str, repo_name: str, failed_branches_file: str,
+                          engine: FetchEngine, cache: Optional[BranchTreeCache] = None) -> List[str]:
     """Process images for a specific branch range"""
-    valid_images = []
+    candidates = []
     branch = branch_info['branch']
+    sha = branch_info.get('sha')
     
-    # Get all jpg files in the branch
-    image_paths = get_branch_contents(repo_owner, repo_name, branch, failed_branches_file)
+    # Branches whose head has not moved are served from the cache without any request
+    unchanged = cache is not None and cache.is_current(branch, sha)
+    if unchanged:
+        image_paths = cache.images(branch)
+    else:
+        # Get all jpg files in the branch
+        with METRICS.phase('fetch'):
+            image_paths = get_branch_contents(repo_owner, repo_name, branch, failed_branches_file, engine, cache, sha)
     
     if not image_paths:
         # Log failed branch
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         with open(failed_branches_file, 'a') as f:
             f.write(f"{timestamp} - Failed to fetch contents for branch: {branch} (range: {branch_info['start']}-{branch_info['end']})\n")
+        METRICS.inc('errors')
+        METRICS.advance()
         return []
     
     # Process each image file
@@ -109,11 +138,20 @@ def process_branch_images(branch_info: Dict[str, any], repo_owner: str, repo_nam
         if match:
             image_number = int(match.group(1))
             if branch_info['start'] <= image_number <= branch_info['end']:
-                url = get_image_url(repo_owner, repo_name, branch, folder, image_name)
-                if check_image_exists(url):
-                    valid_images.append(url)
-                    print(f"Found valid image: {url}")
+                candidates.append(get_image_url(repo_owner, repo_name, branch, folder, image_name))
+    
+    if unchanged:
+        valid_images = candidates
+        METRICS.inc('cached_branches')
+        METRICS.detail(f"Branch {branch} unchanged, reusing {len(valid_images)} cached images")
+    else:
+        with METRICS.phase('validate'):
+            valid_images = verify_images(candidates, engine)
+        METRICS.detail(f"Found {len(valid_images)} valid images in branch {branch}")
     
+    METRICS.inc('hits', len(valid_images))
+    METRICS.inc('misses', len(candidates) - len(valid_images))
+    METRICS.advance()
     return valid_images
 
 def extract_number_from_url(url: str) -> int:
@@ -123,7 +161,31 @@ def extract_number_from_url(url: str) -> int:
         return int(match.group(1))
     return 0
 
-def main(repo_owner: str, repo_name: str, output_file: str):
+def write_diff(cache: BranchTreeCache, repo_owner: str, repo_name: str, diff_file: str):
+    """Write images added (+) and removed (-) since the previous run, one URL per line"""
+    changes = cache.diff()
+    added = removed = 0
+    
+    with open(diff_file, 'w') as f:
+        for branch, change in changes.items():
+            for sign, paths in (('+', change['added']), ('-', change['removed'])):
+                for path in paths:
+                    url = get_image_url(repo_owner, repo_name, branch, os.path.dirname(path), os.path.basename(path))
+                    f.write(f"{sign}{url}\n")
+            added += len(change['added'])
+            removed += len(change['removed'])
+    
+    print(f"Diff: {added} added, {removed} removed across {len(changes)} branches")
+
+def record_ranges(branches: List[Dict[str, any]], results: List[List[str]]):
+    """Store each listed branch's image count and prefixes in the range manifest"""
+    with RangeManifest.transaction(RANGE_MANIFEST_FILE) as manifest:
+        for branch_info, urls in zip(branches, results):
+            if urls:
+                prefixes = {os.path.basename(url)[0].lower() for url in urls}
+                manifest.set_images(branch_info['branch'], prefixes, len(urls), branch_info.get('sha'))
+
+def main(repo_owner: str, repo_name: str, output_file: str, diff_file: Optional[str] = None):
     """Main function to process all branches and save results"""
     # Create logs directory if it doesn't exist
     logs_dir = 'logs'
@@ -134,8 +196,8 @@ def main(repo_owner: str, repo_name: str, output_file: str):
     failed_branches_file = os.path.join(logs_dir, f'failed_branches_{timestamp}.log')
     error_log_file = os.path.join(logs_dir, f'error_log_{timestamp}.log')
     
-    print("Fetching remote branches...")
-    branches = get_remote_branches()
+    print("Loading range manifest...")
+    branches = load_ranges()
     
     if not branches:
         print("No valid branches found")
@@ -143,40 +205,40 @@ def main(repo_owner: str, repo_name: str, output_file: str):
     
     print(f"Found {len(branches)} valid branches")
     
-    # First pass: Process all branches
-    with ThreadPoolExecutor(max_workers=3) as executor:
-        process_branch = partial(
-            process_branch_images, 
-            repo_owner=repo_owner, 
-            repo_name=repo_name,
-            failed_branches_file=failed_branches_file
-        )
-        results = list(executor.map(process_branch, branches))
-    
-    # Get failed branches from log file
-    failed_branches = []
-    if os.path.exists(failed_branches_file):
-        with open(failed_branches_file, 'r') as f:
-            for line in f:
-                if 'Failed to fetch contents for branch:' in line:
-                    match = re.search(r'branch: (\d+_to_\d+) \(range: (\d+)-(\d+)\)', line)
-                    if match:
-                        failed_branches.append({
-                            'branch': match.group(1),
-                            'start': int(match.group(2)),
-                            'end': int(match.group(3))
-                        })
-    
-    # Second pass: Retry failed branches
+    engine = FetchEngine.from_env()
+    cache = BranchTreeCache(BRANCH_CACHE_FILE)
+    cache.prune([branch['branch'] for branch in branches])
+    
+    METRICS.start(len(branches))
+    
+    # Branches hit by persistent rate limits or server errors are retried by the
+    # engine once the other branches are done; None marks one that never succeeded
+    process_branch = partial(
+        process_branch_images, 
+        repo_owner=repo_owner, 
+        repo_name=repo_name,
+        failed_branches_file=failed_branches_file,
+        engine=engine,
+        cache=cache
+    )
+    results = engine.map(process_branch, branches, workers=3)
+    
+    failed_branches = [branch for branch, result in zip(branches, results) if result is None]
     if failed_branches:
-        print(f"\nRetrying {len(failed_branches)} failed branches...")
-        time.sleep(random.randint(300, 600))  # Wait 5-10 minutes before retrying
-        
-        with ThreadPoolExecutor(max_workers=2) as executor:
-            retry_results = list(executor.map(process_branch, failed_branches))
-            
-            # Add successful retries to results
-            results.extend(retry_results)
+        logged_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with open(failed_branches_file, 'a') as f:
+            for branch_info in failed_branches:
+                f.write(f"{logged_at} - Failed to fetch contents for branch: {branch_info['branch']} "
+                        f"(range: {branch_info['start']}-{branch_info['end']}) after retries\n")
+    results = [result or [] for result in results]
+    
+    engine.close()
+    cache.save()
+    record_ranges(branches, results)
+    METRICS.finish()
+    
+    if diff_file:
+        write_diff(cache, repo_owner, repo_name, diff_file)
     
     # Flatten results and sort images
     all_images = [url for branch_results in results for url in branch_results]
@@ -193,17 +255,23 @@ def main(repo_owner: str, repo_name: str, output_file: str):
             for url in all_images:
                 f.write(f"{url}\n")
         
-        # Create new success log
+        # Store the snapshot; unchanged URL sets are not written again
+        store = SnapshotStore(SNAPSHOT_STORE_DIR)
+        snapshot_name = store.write(all_images, timestamp)
+        
+        # Create new success log pointing at the stored snapshot rather than repeating every URL
         success_log = os.path.join(logs_dir, f'success_images_{timestamp}.log')
         with open(success_log, 'w') as f:
             f.write(f"Successfully fetched and sorted images at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}:\n")
-            f.write(f"Total images found: {len(all_images)}\n\n")
-            for url in all_images:
-                f.write(f"{url}\n")
+            f.write(f"Total images found: {len(all_images)}\n")
+            if snapshot_name:
+                f.write(f"Snapshot: {snapshot_name} in {SNAPSHOT_STORE_DIR}\n")
+            else:
+                f.write(f"Snapshot unchanged: {store.latest()['name']} in {SNAPSHOT_STORE_DIR}\n")
         
         print(f"\nFinal Summary:")
         print(f"Total branches processed: {len(branches)}")
-        print(f"Initially failed branches: {len(failed_branches)}")
+        print(f"Failed branches: {len(failed_branches)}")
         print(f"Total images found: {len(all_images)}")
         
         return True
@@ -212,14 +280,15 @@ def main(repo_owner: str, repo_name: str, output_file: str):
         return False
 
 if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        print("Usage: python fetch_branch_images.py <repo_owner> <repo_name> <output_file>")
+    if len(sys.argv) not in (4, 5):
+        print("Usage: python fetch_branch_images.py <repo_owner> <repo_name> <output_file> [diff_file]")
         sys.exit(1)
     
     repo_owner = sys.argv[1]
     repo_name = sys.argv[2]
     output_file = sys.argv[3]
+    diff_file = sys.argv[4] if len(sys.argv) == 5 else None
     
-    success = main(repo_owner, repo_name, output_file)
+    success = main(repo_owner, repo_name, output_file, diff_file)
     if not success:
         sys.exit(1) 
\ No newline at end of file
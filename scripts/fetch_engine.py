@@ -0,0 +1,341 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import METRICS, endpoint_of
+
+DEFAULT_CONCURRENCY = 5
+DEFAULT_RATE_LIMIT = 10.0
+DEFAULT_TIMEOUT = 10
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+class TransientError(requests.RequestException):
+    """A request that may succeed later; map() and feed() re-run its item at the end of the run"""
+
+class RetryExhausted(TransientError):
+    pass
+
+class CircuitOpen(TransientError):
+    pass
+
+class RetryPolicy:
+    """Per-request retries with exponential backoff and full jitter, plus end-of-run retry rounds"""
+
+    def __init__(self, retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 30.0,
+                 max_wait: float = 60.0, breaker_threshold: int = 5, breaker_cooldown: float = 30.0,
+                 rounds: int = 1):
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # Server-requested waits longer than this fail fast and are retried at the end of the run
+        self.max_wait = max_wait
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.rounds = rounds
+
+    @classmethod
+    def from_env(cls) -> 'RetryPolicy':
+        return cls(
+            retries=int(os.environ.get('FETCH_RETRIES', 3)),
+            backoff_base=float(os.environ.get('FETCH_BACKOFF_BASE', 0.5)),
+            backoff_max=float(os.environ.get('FETCH_BACKOFF_MAX', 30.0)),
+            max_wait=float(os.environ.get('FETCH_MAX_WAIT', 60.0)),
+            breaker_threshold=int(os.environ.get('FETCH_BREAKER_THRESHOLD', 5)),
+            breaker_cooldown=float(os.environ.get('FETCH_BREAKER_COOLDOWN', 30.0)),
+            rounds=int(os.environ.get('FETCH_RETRY_ROUNDS', 1)),
+        )
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+def is_rate_limited(response: requests.Response) -> bool:
+    # GitHub answers an exhausted primary rate limit with 403 rather than 429
+    return response.status_code == 429 or (
+        response.status_code == 403 and response.headers.get('X-RateLimit-Remaining') == '0')
+
+def server_delay(response: requests.Response) -> Optional[float]:
+    """Seconds the server asked us to wait, from Retry-After or X-RateLimit-Reset"""
+    retry_after = response.headers.get('Retry-After')
+    if retry_after:
+        if retry_after.strip().isdigit():
+            return float(retry_after)
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    reset = response.headers.get('X-RateLimit-Reset')
+    if reset and reset.isdigit() and is_rate_limited(response):
+        return max(0.0, int(reset) - time.time())
+    return None
+
+class HostState:
+    """Circuit breaker and server-requested pause shared by every request to one host"""
+
+    def __init__(self, policy: RetryPolicy):
+        self.policy = policy
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.blocked_until = 0.0
+
+    def wait_time(self) -> float:
+        now = time.monotonic()
+        with self.lock:
+            reopen = self.opened_at + self.policy.breaker_cooldown - now if self.opened_at else 0.0
+            return max(0.0, self.blocked_until - now, reopen)
+
+    def before_request(self, host: str):
+        """Wait out a short pause, or raise when the host is paused too long or its circuit is open"""
+        with self.lock:
+            now = time.monotonic()
+            if self.opened_at is not None:
+                if now - self.opened_at < self.policy.breaker_cooldown:
+                    raise CircuitOpen(f"Circuit open for {host}")
+                # Half-open: let this request through as the trial and keep the others out
+                self.opened_at = now
+            pause = self.blocked_until - now
+        if pause > self.policy.max_wait:
+            raise RetryExhausted(f"{host} asked to wait {pause:.0f}s")
+        if pause > 0:
+            time.sleep(pause)
+
+    def block(self, seconds: float):
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self, host: str):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.policy.breaker_threshold and self.opened_at is None:
+                self.opened_at = time.monotonic()
+                METRICS.inc('circuit_opened', host=host)
+                print(f"Circuit opened for {host} after {self.failures} consecutive failures")
+
+class TokenBucket:
+    """Thread-safe token bucket limiting how many requests start per second"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then consume it"""
+        if self.rate <= 0:
+            return
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+class FetchEngine:
+    """Shared HTTP engine: one keep-alive session, bounded concurrency and rate limiting"""
+
+    def __init__(self, concurrency: int = DEFAULT_CONCURRENCY, rate_limit: float = DEFAULT_RATE_LIMIT,
+                 timeout: float = DEFAULT_TIMEOUT, retry: Optional[RetryPolicy] = None):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate_limit)
+        self.retry = retry or RetryPolicy()
+        self.hosts: Dict[str, HostState] = {}
+        self.hosts_lock = threading.Lock()
+
+        # Size the pool to the worker count so every worker keeps its connection alive
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @classmethod
+    def from_env(cls, **overrides) -> 'FetchEngine':
+        """Build an engine configured from FETCH_CONCURRENCY / FETCH_RATE_LIMIT / FETCH_TIMEOUT and the retry variables"""
+        settings = {
+            'concurrency': int(os.environ.get('FETCH_CONCURRENCY', DEFAULT_CONCURRENCY)),
+            'rate_limit': float(os.environ.get('FETCH_RATE_LIMIT', DEFAULT_RATE_LIMIT)),
+            'timeout': float(os.environ.get('FETCH_TIMEOUT', DEFAULT_TIMEOUT)),
+            'retry': RetryPolicy.from_env(),
+        }
+        settings.update(overrides)
+        return cls(**settings)
+
+    def _host(self, host: str) -> HostState:
+        with self.hosts_lock:
+            if host not in self.hosts:
+                self.hosts[host] = HostState(self.retry)
+            return self.hosts[host]
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Send a rate-limited request over the pooled session, retrying transient failures.
+
+        Connection errors, timeouts, 5xx and rate-limit replies are retried with
+        backoff, honouring Retry-After and X-RateLimit-Reset. A pause requested
+        by the server applies to every worker talking to that host. When retries
+        run out, or the host's circuit is open, TransientError is raised.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        host = urlparse(url).netloc
+        state = self._host(host)
+
+        for attempt in range(self.retry.retries + 1):
+            state.before_request(host)
+            self.bucket.acquire()
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                METRICS.record_request(url, 'error', time.perf_counter() - started)
+                state.failure(host)
+                if attempt == self.retry.retries:
+                    raise RetryExhausted(f"{method} {url}: {e}") from e
+                delay = self.retry.backoff(attempt)
+            else:
+                METRICS.record_request(url, response.status_code, time.perf_counter() - started)
+                rate_limited = is_rate_limited(response)
+                if response.status_code not in RETRYABLE_STATUSES and not rate_limited:
+                    state.success()
+                    return response
+
+                # Rate limits pause the host; only server errors count towards the breaker
+                if not rate_limited:
+                    state.failure(host)
+                requested = server_delay(response)
+                response.close()
+                if requested is not None:
+                    state.block(requested)
+                if attempt == self.retry.retries or (requested or 0) > self.retry.max_wait:
+                    raise RetryExhausted(f"{method} {url}: HTTP {response.status_code}", response=response)
+                delay = 0.0 if requested is not None else self.retry.backoff(attempt)
+
+            METRICS.inc('retries', endpoint=endpoint_of(url))
+            time.sleep(delay)
+
+    def wait_for_hosts(self):
+        """Sleep until paused hosts and open circuits may be tried again, up to the policy's max wait"""
+        with self.hosts_lock:
+            states = list(self.hosts.values())
+        pause = max((state.wait_time() for state in states), default=0.0)
+        if pause > 0:
+            time.sleep(min(pause, self.retry.max_wait))
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url: str, **kwargs) -> requests.Response:
+        return self.request('HEAD', url, **kwargs)
+
+    def map(self, func: Callable[[Any], Any], items: Iterable[Any], workers: Optional[int] = None) -> List[Any]:
+        """Run func over items on a worker pool, preserving order.
+
+        Items whose call raises TransientError are queued and run again once
+        the main pass is done, for up to the policy's retry rounds; an item that
+        still fails gets None as its result.
+        """
+        items = list(items)
+        results: List[Any] = [None] * len(items)
+        pending = list(range(len(items)))
+
+        with ThreadPoolExecutor(max_workers=workers or self.concurrency) as executor:
+            for round_number in range(self.retry.rounds + 1):
+                if round_number:
+                    print(f"Retrying {len(pending)} items after transient failures")
+                    self.wait_for_hosts()
+                futures = [(i, executor.submit(func, items[i])) for i in pending]
+                pending = []
+                for i, future in futures:
+                    try:
+                        results[i] = future.result()
+                    except TransientError:
+                        pending.append(i)
+                if not pending:
+                    break
+
+        if pending:
+            METRICS.inc('dropped', len(pending))
+            print(f"{len(pending)} items still failing after {self.retry.rounds} retry rounds")
+        return results
+
+    def feed(self, func: Callable[[Any], Any], items: Iterable[Any],
+             on_result: Callable[[Any, Any], Optional[Iterable[Any]]]):
+        """Run func over a continuously fed work queue instead of fixed batches.
+
+        Up to `concurrency` calls are in flight at once and a slow call never
+        holds up the others. on_result(item, result) runs on the calling thread
+        as each call finishes and may return new items to enqueue; an item is
+        never queued twice. Items whose call raises TransientError are re-run
+        after the queue drains, and reported with a None result if they still
+        fail after the policy's retry rounds.
+        """
+        pending = deque(items)
+        seen = set(pending)
+        deferred = []
+        rounds = 0
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            in_flight = {}
+            while pending or in_flight or deferred:
+                if not pending and not in_flight:
+                    if rounds == self.retry.rounds:
+                        break
+                    rounds += 1
+                    print(f"Retrying {len(deferred)} items after transient failures")
+                    self.wait_for_hosts()
+                    pending.extend(deferred)
+                    deferred = []
+
+                while pending and len(in_flight) < self.concurrency:
+                    item = pending.popleft()
+                    in_flight[executor.submit(func, item)] = item
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = in_flight.pop(future)
+                    try:
+                        result = future.result()
+                    except TransientError:
+                        deferred.append(item)
+                        continue
+                    for new_item in on_result(item, result) or ():
+                        if new_item not in seen:
+                            seen.add(new_item)
+                            pending.append(new_item)
+
+        if deferred:
+            METRICS.inc('dropped', len(deferred))
+            print(f"{len(deferred)} items still failing after {self.retry.rounds} retry rounds")
+            for item in deferred:
+                on_result(item, None)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
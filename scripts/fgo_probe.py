@@ -0,0 +1,69 @@
+import os
+import threading
+from typing import Iterator, Optional, Tuple
+
+import requests
+
+# Overridable so benchmarks can point the scripts at a local stub server
+FGO_BASE_URL = os.environ.get('FGO_BASE_URL', 'https://fgo.vn')
+IMAGE_URL = FGO_BASE_URL + "/tai-anh-ve/?id={code}"
+CHUNK_SIZE = 64 * 1024
+
+VALID = 'valid'
+INVALID = 'invalid'
+ERROR = 'error'
+
+# Leading and closing bytes of the image formats the endpoint serves
+IMAGE_FORMATS = (
+    (b'\xff\xd8\xff', b'\xff\xd9'),
+    (b'\x89PNG\r\n\x1a\n', b'IEND\xaeB`\x82'),
+    (b'GIF87a', b';'),
+    (b'GIF89a', b';'),
+)
+IMAGE_MAGICS = tuple(magic for magic, _ in IMAGE_FORMATS)
+MAGIC_SIZE = max(len(magic) for magic in IMAGE_MAGICS)
+
+_log_lock = threading.Lock()
+
+def image_url(code_str: str) -> str:
+    """Build the fgo.vn download URL for a full code such as s89120"""
+    return IMAGE_URL.format(code=code_str)
+
+def image_trailer(head: bytes) -> Optional[bytes]:
+    """Closing bytes expected of an image that starts with head, or None if head is no served format"""
+    for magic, trailer in IMAGE_FORMATS:
+        if head.startswith(magic):
+            return trailer
+    return None
+
+def classify_response(response: requests.Response, head: bytes) -> str:
+    """Classify a response from its status, Content-Type and first bytes without decoding the body"""
+    if response.status_code != 200:
+        return ERROR
+
+    # The "Mã hình ảnh không đúng!" page is served as HTML
+    content_type = response.headers.get('Content-Type', '').lower()
+    if content_type.startswith('text/'):
+        return INVALID
+
+    if image_trailer(head) is not None:
+        return VALID
+
+    return INVALID
+
+def probe(engine, code_str: str) -> Tuple[str, requests.Response, bytes, Iterator[bytes]]:
+    """Open a streamed request for a code and classify it from the first chunk.
+
+    Returns the status, the open response, the first chunk and an iterator over
+    the remaining chunks. The caller is responsible for closing the response.
+    """
+    response = engine.get(image_url(code_str), stream=True)
+    chunks = response.iter_content(CHUNK_SIZE)
+    head = next(chunks, b'')
+    return classify_response(response, head), response, head, chunks
+
+def log_valid_code(log_file: str, code_str: str):
+    """Append a valid code to a valid-codes log, safe to call from worker threads"""
+    with _log_lock:
+        with open(log_file, 'a') as f:
+            f.write(f"{code_str}\n")
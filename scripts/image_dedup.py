@@ -0,0 +1,229 @@
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+from typing import Dict, List, Optional, Tuple
+from PIL import Image
+from image_store import ImageStore, sha256_file
+
+OFF = 'off'
+EXACT = 'exact'
+NEAR = 'near'
+
+DEFAULT_MAX_DISTANCE = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    code TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    dhash TEXT NOT NULL,
+    ref TEXT
+)
+"""
+
+def dhash(path: str) -> int:
+    """64-bit difference hash: sign of the horizontal gradient on a 9x8 greyscale thumbnail"""
+    with Image.open(path) as img:
+        # Let the JPEG decoder downscale while decoding instead of decoding full size
+        img.draft('L', (64, 64))
+        pixels = list(img.convert('L').resize((9, 8), Image.LANCZOS).getdata())
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+class BKTree:
+    """Burkhard-Keller tree over 64-bit hashes for Hamming-radius queries"""
+
+    def __init__(self):
+        # node: [hash, codes, {distance: child}]
+        self.root = None
+
+    def add(self, value: int, code: str):
+        if self.root is None:
+            self.root = [value, [code], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(code)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [code], {}]
+                return
+            node = child
+
+    def search(self, value: int, radius: int) -> List[Tuple[int, str]]:
+        """(distance, code) pairs within radius, nearest first"""
+        found = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius:
+                found.extend((distance, code) for code in node[1])
+            # Triangle inequality: only children within [d - r, d + r] can match
+            for child_distance, child in node[2].items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        return sorted(found)
+
+class DedupIndex:
+    """Content-addressed index of stored images: SHA-256 for exact and dHash for near duplicates"""
+
+    def __init__(self, path: str, mode: str = EXACT, max_distance: int = DEFAULT_MAX_DISTANCE):
+        self.path = path
+        self.mode = mode
+        self.max_distance = max_distance
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(SCHEMA)
+        self.conn.commit()
+
+        # Only images stored as bytes are candidates to reference
+        self.by_sha: Dict[str, str] = {}
+        self.tree = BKTree()
+        for code, sha, hash_hex in self.conn.execute("SELECT code, sha256, dhash FROM images WHERE ref IS NULL"):
+            self.by_sha[sha] = code
+            if hash_hex:
+                self.tree.add(int(hash_hex, 16), code)
+
+    @classmethod
+    def from_env(cls) -> Optional['DedupIndex']:
+        """Open the index named by DEDUP_INDEX_FILE, or return None when it is not configured"""
+        path = os.environ.get('DEDUP_INDEX_FILE')
+        if not path:
+            return None
+        return cls(path,
+                   os.environ.get('DEDUP_MODE', EXACT),
+                   int(os.environ.get('DEDUP_MAX_DISTANCE', DEFAULT_MAX_DISTANCE)))
+
+    def find_near(self, hash_value: Optional[int]) -> Optional[str]:
+        if self.mode != NEAR or hash_value is None:
+            return None
+        matches = self.tree.search(hash_value, self.max_distance)
+        return matches[0][1] if matches else None
+
+    def register(self, code: str, path: str, sha: Optional[str] = None) -> Tuple[Optional[str], Optional[str]]:
+        """Index a stored image and return (exact, near): the codes it duplicates byte-for-byte or resembles.
+
+        Only an exact match may replace the image with a reference; a near
+        match is reported, since a dHash collision would otherwise delete a
+        real image. The check and the insert happen under one lock so two
+        workers cannot both claim the same content as the original.
+        """
+        sha = sha or sha256_file(path)
+        try:
+            hash_value = dhash(path)
+        except Exception as e:
+            # The bytes are stored either way; exact matching does not need the hash
+            print(f"Cannot hash {code} for near-duplicate matching: {e}")
+            hash_value = None
+
+        with self.lock:
+            ref = self.by_sha.get(sha) if self.mode != OFF else None
+            if ref == code:
+                ref = None
+            near = self.find_near(hash_value) if ref is None else None
+            if near == code:
+                near = None
+            self.conn.execute(
+                "INSERT OR REPLACE INTO images (code, sha256, dhash, ref) VALUES (?, ?, ?, ?)",
+                (code, sha, f"{hash_value:016x}" if hash_value is not None else '', ref)
+            )
+            self.conn.commit()
+            if ref is None:
+                self.by_sha.setdefault(sha, code)
+                if hash_value is not None:
+                    self.tree.add(hash_value, code)
+        return ref, near
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+def store_as_reference(image_path: str, ref: str, sha: str):
+    """Replace a duplicate image with a small .ref file naming the stored original"""
+    ref_path = os.path.splitext(image_path)[0] + '.ref'
+    with open(ref_path, 'w') as f:
+        f.write(f"{ref}\t{sha}\n")
+    os.remove(image_path)
+    return ref_path
+
+def resolve_references(folder: str, store=None) -> Tuple[int, int]:
+    """Turn every {code}.ref in folder back into {code}.jpg and return (resolved, unresolved).
+
+    Range branches, snapshots and uploads only know .jpg files. The original
+    comes from the same folder, hard-linked when possible, or from the image
+    store by SHA-256. Git stores identical bytes once, so branches do not grow.
+    """
+    resolved = unresolved = 0
+    for name in sorted(os.listdir(folder)):
+        if not name.endswith('.ref'):
+            continue
+        ref_path = os.path.join(folder, name)
+        code = os.path.splitext(name)[0]
+        with open(ref_path, 'r') as f:
+            ref, sha = f.read().strip().split('\t')
+
+        target_path = os.path.join(folder, f"{code}.jpg")
+        original_path = os.path.join(folder, f"{ref}.jpg")
+        if os.path.exists(original_path):
+            try:
+                os.link(original_path, target_path)
+            except OSError:
+                shutil.copyfile(original_path, target_path)
+        elif store and store.backend.exists(sha):
+            store.backend.export(sha, target_path)
+        else:
+            print(f"Cannot resolve {ref_path}: original {ref} not found")
+            unresolved += 1
+            continue
+        os.remove(ref_path)
+        resolved += 1
+    return resolved, unresolved
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python image_dedup.py <index_file> <image_folder>...")
+        print("       python image_dedup.py resolve <image_folder>...")
+        sys.exit(1)
+
+    if sys.argv[1] == 'resolve':
+        store = ImageStore.from_env()
+        failed = 0
+        for folder in sys.argv[2:]:
+            resolved, unresolved = resolve_references(folder, store)
+            failed += unresolved
+            print(f"{folder}: resolved {resolved} references, {unresolved} unresolved")
+        if store:
+            store.close()
+        sys.exit(1 if failed else 0)
+
+    # Index existing folders and report duplicates without touching any file
+    index = DedupIndex(sys.argv[1], os.environ.get('DEDUP_MODE', EXACT))
+    duplicates = similar = 0
+    for folder in sys.argv[2:]:
+        for name in sorted(os.listdir(folder)):
+            if not name.lower().endswith('.jpg'):
+                continue
+            code = os.path.splitext(name)[0]
+            ref, near = index.register(code, os.path.join(folder, name))
+            if ref:
+                duplicates += 1
+                print(f"{code} duplicates {ref}")
+            elif near:
+                similar += 1
+                print(f"{code} resembles {near}")
+    index.close()
+    print(f"Found {duplicates} duplicates and {similar} near duplicates")
@@ -0,0 +1,119 @@
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Dict, List, Optional, Sequence
+from PIL import Image
+from metrics import METRICS
+
+DEFAULT_SIZES = (160, 480)
+DEFAULT_FORMATS = ('jpeg', 'webp')
+DEFAULT_QUALITY = 80
+
+# Appended to once per image, so reruns only add lines; later lines win when read
+META_FILE = 'image_meta.jsonl'
+
+EXTENSIONS = {'jpeg': 'jpg', 'webp': 'webp'}
+
+def derive(path: str, output_dir: str, sizes: Sequence[int], formats: Sequence[str], quality: int) -> Dict:
+    """Write every size and format of one image to {output_dir}/{size}/{code}.{ext} and describe them.
+
+    Each variant's path is relative to the image's own folder, so with the
+    output inside that folder it is published on the same branch and its
+    URL sits beside the image's. Runs in a worker process. Errors are
+    returned rather than raised so one bad file does not stop the batch.
+    """
+    started = time.perf_counter()
+    code = os.path.splitext(os.path.basename(path))[0]
+    try:
+        record = {'code': code, 'bytes': os.path.getsize(path), 'variants': {}}
+        with Image.open(path) as img:
+            record['width'], record['height'] = img.size
+            # Decode straight to the smallest 1/2, 1/4 or 1/8 scale that still covers the largest size
+            img.draft('RGB', (max(sizes), max(sizes)))
+            image = img.convert('RGB')
+
+        # Largest first, so each thumbnail is shrunk from the previous one
+        for size in sorted(sizes, reverse=True):
+            image.thumbnail((size, size), Image.LANCZOS)
+            for image_format in formats:
+                extension = EXTENSIONS[image_format]
+                target_path = os.path.join(output_dir, str(size), f"{code}.{extension}")
+                image.save(target_path, image_format.upper(), quality=quality)
+                record['variants'][f"{size}.{extension}"] = {
+                    'width': image.width, 'height': image.height, 'bytes': os.path.getsize(target_path),
+                    'path': os.path.relpath(target_path, os.path.dirname(path)).replace(os.sep, '/'),
+                }
+    except Exception as e:
+        record = {'code': code, 'error': str(e)}
+    record['seconds'] = time.perf_counter() - started
+    return record
+
+class DerivativeStage:
+    """Thumbnails and WebP variants of downloaded images, built across a process pool"""
+
+    def __init__(self, output_dir: str, sizes: Sequence[int] = DEFAULT_SIZES,
+                 formats: Sequence[str] = DEFAULT_FORMATS, quality: int = DEFAULT_QUALITY,
+                 workers: Optional[int] = None):
+        unknown = set(formats) - set(EXTENSIONS)
+        if unknown:
+            raise ValueError(f"Unknown derivative formats: {', '.join(sorted(unknown))}")
+        self.output_dir = output_dir
+        self.sizes = tuple(sizes)
+        self.formats = tuple(formats)
+        self.quality = quality
+        self.workers = workers or os.cpu_count() or 1
+        self.meta_path = os.path.join(output_dir, META_FILE)
+
+    @classmethod
+    def from_env(cls, output_dir: Optional[str] = None) -> Optional['DerivativeStage']:
+        """Configured from DERIVATIVES_DIR and DERIVATIVE_*, or None when the stage is not enabled"""
+        output_dir = output_dir or os.environ.get('DERIVATIVES_DIR')
+        if not output_dir:
+            return None
+        sizes = os.environ.get('DERIVATIVE_SIZES')
+        formats = os.environ.get('DERIVATIVE_FORMATS')
+        return cls(output_dir,
+                   tuple(int(size) for size in sizes.split(',')) if sizes else DEFAULT_SIZES,
+                   tuple(formats.lower().split(',')) if formats else DEFAULT_FORMATS,
+                   int(os.environ.get('DERIVATIVE_QUALITY', DEFAULT_QUALITY)),
+                   int(os.environ.get('DERIVATIVE_WORKERS', 0)) or None)
+
+    def run(self, paths: List[str]) -> List[Dict]:
+        """Build the derivatives of every image and append their metadata, returning the records"""
+        for size in self.sizes:
+            os.makedirs(os.path.join(self.output_dir, str(size)), exist_ok=True)
+        if not paths:
+            return []
+
+        build = partial(derive, output_dir=self.output_dir, sizes=self.sizes, formats=self.formats,
+                        quality=self.quality)
+        # Chunks keep pickling overhead low without leaving workers idle at the end
+        chunksize = max(1, len(paths) // (self.workers * 4))
+        records = []
+        with ProcessPoolExecutor(max_workers=self.workers) as executor, open(self.meta_path, 'a') as meta:
+            for record in executor.map(build, paths, chunksize=chunksize):
+                METRICS.observe('phase_seconds', record.pop('seconds'), phase='derive')
+                if 'error' in record:
+                    METRICS.inc('errors', reason='derive')
+                    print(f"Failed to build derivatives for {record['code']}: {record['error']}")
+                    continue
+                METRICS.inc('derived')
+                METRICS.inc('derivative_bytes', sum(variant['bytes'] for variant in record['variants'].values()))
+                meta.write(json.dumps(record, sort_keys=True) + '\n')
+                records.append(record)
+
+        print(f"Built derivatives for {len(records)} of {len(paths)} images in {self.output_dir}")
+        return records
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python image_derivatives.py <output_dir> <image_folder>...")
+        sys.exit(1)
+
+    stage = DerivativeStage.from_env(sys.argv[1])
+    paths = [os.path.join(folder, name) for folder in sys.argv[2:]
+             for name in sorted(os.listdir(folder)) if name.lower().endswith('.jpg')]
+    stage.run(paths)
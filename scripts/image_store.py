@@ -0,0 +1,233 @@
+import hashlib
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from pack_file import PackBackend
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS codes (
+    prefix TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    branch TEXT,
+    folder TEXT,
+    stored_at REAL NOT NULL,
+    PRIMARY KEY (prefix, number)
+) WITHOUT ROWID
+"""
+
+CODE_PATTERN = re.compile(r'^([a-z])(\d+)$')
+# images_{prefix}_{date}_{start}_to_{end}, the folder layout used by the range branches
+FOLDER_BRANCH_PATTERN = re.compile(r'(\d+_to_\d+)$')
+
+def split_code(code_str: str) -> Tuple[str, int]:
+    match = CODE_PATTERN.match(code_str.lower())
+    if not match:
+        raise ValueError(f"Invalid image code: {code_str}")
+    return match.group(1), int(match.group(2))
+
+def branch_for_folder(folder: str) -> Optional[str]:
+    match = FOLDER_BRANCH_PATTERN.search(os.path.basename(os.path.normpath(folder)))
+    return match.group(1) if match else None
+
+class FilesystemBackend:
+    """One file per object under objects/ab/cdef..., named by SHA-256"""
+
+    def __init__(self, root: str):
+        self.root = os.path.join(root, 'objects')
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, sha: str) -> str:
+        return os.path.join(self.root, sha[:2], sha[2:])
+
+    def exists(self, sha: str) -> bool:
+        return os.path.exists(self._path(sha))
+
+    def put_file(self, sha: str, source_path: str):
+        path = self._path(sha)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        os.close(fd)
+        shutil.copyfile(source_path, temp_path)
+        os.replace(temp_path, path)
+
+    def get(self, sha: str) -> bytes:
+        with open(self._path(sha), 'rb') as f:
+            return f.read()
+
+    def export(self, sha: str, target_path: str):
+        """Materialise an object at target_path, hard-linking when possible"""
+        try:
+            os.link(self._path(sha), target_path)
+        except OSError:
+            shutil.copyfile(self._path(sha), target_path)
+
+    def close(self):
+        pass
+
+BACKENDS = {
+    'fs': FilesystemBackend,
+    'pack': PackBackend,
+}
+
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ImageStore:
+    """Content-addressed image store with a (prefix, number) -> object index.
+
+    Objects are deduplicated by SHA-256 in a pluggable backend; the index also
+    keeps the branch and folder each code belongs to so the per-range branch
+    layout and URL snapshots can be regenerated from local data.
+    """
+
+    def __init__(self, root: str, backend: str = 'fs'):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.backend = BACKENDS[backend](root)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(root, 'index.db'), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(SCHEMA)
+        self.conn.commit()
+
+    @classmethod
+    def from_env(cls) -> Optional['ImageStore']:
+        """Open the store named by IMAGE_STORE_DIR, or return None when it is not configured"""
+        root = os.environ.get('IMAGE_STORE_DIR')
+        if not root:
+            return None
+        return cls(root, os.environ.get('IMAGE_STORE_BACKEND', 'fs'))
+
+    def add_file(self, code_str: str, path: str, sha: Optional[str] = None,
+                 branch: Optional[str] = None, folder: Optional[str] = None) -> str:
+        """Store an image file under its code and return its SHA-256"""
+        prefix, number = split_code(code_str)
+        sha = sha or sha256_file(path)
+        self.backend.put_file(sha, path)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO codes (prefix, number, sha256, size, branch, folder, stored_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (prefix, number, sha, os.path.getsize(path), branch, folder, time.time())
+            )
+            self.conn.commit()
+        return sha
+
+    def ingest_folder(self, folder: str, branch: Optional[str] = None) -> int:
+        """Add every image of an images_* folder, deriving the branch from its name"""
+        branch = branch or branch_for_folder(folder)
+        folder_name = os.path.basename(os.path.normpath(folder))
+        added = 0
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                code_str, ext = os.path.splitext(entry.name)
+                if ext.lower() != '.jpg' or not CODE_PATTERN.match(code_str.lower()):
+                    continue
+                self.add_file(code_str.lower(), entry.path, branch=branch, folder=folder_name)
+                added += 1
+        return added
+
+    def lookup(self, code_str: str) -> Optional[Dict]:
+        prefix, number = split_code(code_str)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT sha256, size, branch, folder FROM codes WHERE prefix = ? AND number = ?",
+                (prefix, number)
+            ).fetchone()
+        if not row:
+            return None
+        return {'code': code_str, 'sha256': row[0], 'size': row[1], 'branch': row[2], 'folder': row[3]}
+
+    def get(self, code_str: str) -> Optional[bytes]:
+        entry = self.lookup(code_str)
+        return self.backend.get(entry['sha256']) if entry else None
+
+    def range(self, prefix: str, start: int, end: int) -> List[int]:
+        """Stored numbers for prefix in [start, end], ascending"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT number FROM codes WHERE prefix = ? AND number BETWEEN ? AND ? ORDER BY number",
+                (prefix, start, end)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def entries(self) -> List[Dict]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT prefix, number, sha256, branch, folder FROM codes ORDER BY prefix, number"
+            ).fetchall()
+        return [{'code': f"{prefix}{number}", 'sha256': sha, 'branch': branch, 'folder': folder}
+                for prefix, number, sha, branch, folder in rows]
+
+    def snapshot_urls(self, repo_owner: str, repo_name: str) -> List[str]:
+        """raw.githubusercontent.com URLs in the order fetch_branch_images writes them"""
+        urls = [
+            f"https://raw.githubusercontent.com/{repo_owner}/{repo_name}/refs/heads/"
+            f"{entry['branch']}/{entry['folder']}/{entry['code']}.jpg"
+            for entry in self.entries() if entry['branch'] and entry['folder']
+        ]
+        return sorted(urls, key=lambda url: os.path.basename(url).lower())
+
+    def export(self, destination: str) -> int:
+        """Write the branch/folder layout: destination/{branch}/{folder}/{code}.jpg"""
+        exported = 0
+        for entry in self.entries():
+            if not entry['branch'] or not entry['folder']:
+                continue
+            folder = os.path.join(destination, entry['branch'], entry['folder'])
+            os.makedirs(folder, exist_ok=True)
+            target_path = os.path.join(folder, f"{entry['code']}.jpg")
+            if not os.path.exists(target_path):
+                self.backend.export(entry['sha256'], target_path)
+                exported += 1
+        return exported
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+        self.backend.close()
+
+def usage():
+    print("Usage: python image_store.py <store_dir> ingest <image_folder>...")
+    print("       python image_store.py <store_dir> export <destination>")
+    print("       python image_store.py <store_dir> list <prefix> <start_code> <end_code>")
+    print("       python image_store.py <store_dir> snapshot <repo_owner> <repo_name>")
+    sys.exit(1)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        usage()
+
+    store = ImageStore(sys.argv[1], os.environ.get('IMAGE_STORE_BACKEND', 'fs'))
+    command, args = sys.argv[2], sys.argv[3:]
+
+    if command == 'ingest':
+        for folder in args:
+            print(f"{folder}: {store.ingest_folder(folder)} images")
+    elif command == 'export' and len(args) == 1:
+        print(f"Exported {store.export(args[0])} images")
+    elif command == 'list' and len(args) == 3:
+        for number in store.range(args[0], int(args[1]), int(args[2])):
+            print(f"{args[0]}{number}")
+    elif command == 'snapshot' and len(args) == 2:
+        for url in store.snapshot_urls(args[0], args[1]):
+            print(url)
+    else:
+        store.close()
+        usage()
+
+    store.close()
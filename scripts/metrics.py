@@ -0,0 +1,212 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+# Latency buckets in seconds, shared by every histogram
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+Labels = Tuple[Tuple[str, str], ...]
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def endpoint_of(url: str) -> str:
+    """Host plus first path segment, e.g. fgo.vn/tai-anh-ve or api.github.com/repos"""
+    parsed = urlparse(url)
+    segment = parsed.path.lstrip('/').split('/', 1)[0]
+    return f"{parsed.netloc}/{segment}" if segment else parsed.netloc
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else f"{value:.6f}"
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, fraction: float) -> float:
+        """Upper bound of the bucket holding the given quantile"""
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return BUCKETS[-1]
+
+class Metrics:
+    """Thread-safe counters, latency histograms and phase timers for one script run.
+
+    A background thread prints one progress line every `interval` seconds in
+    place of per-item prints. finish() prints a summary and, when `path` is
+    set, writes the final values as Prometheus text (*.prom) or JSON lines.
+    """
+
+    def __init__(self, path: Optional[str] = None, interval: float = 10.0, verbose: bool = False):
+        self.path = path
+        self.interval = interval
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self.script = os.path.splitext(os.path.basename(sys.argv[0]))[0] or 'python'
+        self.started = time.monotonic()
+        self.total: Optional[int] = None
+        self.done = 0
+        self.stop = threading.Event()
+        self.thread = None
+
+    @classmethod
+    def from_env(cls) -> 'Metrics':
+        """Configured from METRICS_FILE, METRICS_PROGRESS_INTERVAL and METRICS_VERBOSE"""
+        return cls(os.environ.get('METRICS_FILE') or None,
+                   float(os.environ.get('METRICS_PROGRESS_INTERVAL', 10.0)),
+                   os.environ.get('METRICS_VERBOSE', '').lower() in ('1', 'true', 'yes'))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def record_request(self, url: str, status: object, seconds: float):
+        """Count one HTTP request and observe its time to response headers"""
+        endpoint = endpoint_of(url)
+        self.inc('requests', endpoint=endpoint, status=status)
+        self.observe('request_seconds', seconds, endpoint=endpoint)
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time a block as one observation of phase_seconds{phase=name}"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('phase_seconds', time.perf_counter() - started, phase=name)
+
+    def detail(self, message: str):
+        """Per-item message, printed only with METRICS_VERBOSE"""
+        if self.verbose:
+            print(message)
+
+    def start(self, total: Optional[int] = None):
+        """Begin periodic progress reporting for a run of `total` items"""
+        self.total = total
+        self.started = time.monotonic()
+        if self.interval > 0 and self.thread is None:
+            self.thread = threading.Thread(target=self._report, daemon=True)
+            self.thread.start()
+
+    def advance(self, count: int = 1):
+        with self.lock:
+            self.done += count
+
+    def _report(self):
+        while not self.stop.wait(self.interval):
+            print(self.progress_line(), flush=True)
+            if self.path and not self.path.endswith('.prom'):
+                self._append_json(self.snapshot(final=False))
+
+    def progress_line(self) -> str:
+        elapsed = time.monotonic() - self.started
+        with self.lock:
+            done = self.done
+            totals: Dict[str, float] = {}
+            for (name, _), value in self.counters.items():
+                totals[name] = totals.get(name, 0) + value
+        progress = f"{done}/{self.total}" if self.total else str(done)
+        rate = done / elapsed if elapsed > 0 else 0.0
+        counters = ' '.join(f"{name}={_number(value)}" for name, value in sorted(totals.items()))
+        return f"[{self.script}] {progress} in {elapsed:.0f}s ({rate:.1f}/s) {counters}".rstrip()
+
+    def snapshot(self, final: bool = True) -> Dict:
+        with self.lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self.counters.items())]
+            histograms = [{'name': name, 'labels': dict(labels), 'count': h.count, 'sum': round(h.sum, 6),
+                           'p50': h.quantile(0.5), 'p99': h.quantile(0.99)}
+                          for (name, labels), h in sorted(self.histograms.items())] if final else []
+            done = self.done
+        return {'script': self.script, 'time': time.time(), 'elapsed': round(time.monotonic() - self.started, 3),
+                'done': done, 'total': self.total, 'final': final,
+                'counters': counters, 'histograms': histograms}
+
+    def prometheus(self) -> str:
+        lines = []
+        with self.lock:
+            for name in sorted({name for name, _ in self.counters}):
+                metric = f"fgo_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                for (counter, labels), value in sorted(self.counters.items()):
+                    if counter == name:
+                        lines.append(f"{metric}{_format_labels((('script', self.script),) + labels)} {_number(value)}")
+            for name in sorted({name for name, _ in self.histograms}):
+                metric = f"fgo_{name}"
+                lines.append(f"# TYPE {metric} histogram")
+                for (histogram_name, labels), h in sorted(self.histograms.items()):
+                    if histogram_name != name:
+                        continue
+                    labels = (('script', self.script),) + labels
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS, h.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else f"{bound:g}"
+                        lines.append(f"{metric}_bucket{_format_labels(labels, ('le', le))} {cumulative}")
+                    lines.append(f"{metric}_sum{_format_labels(labels)} {h.sum:.6f}")
+                    lines.append(f"{metric}_count{_format_labels(labels)} {h.count}")
+        return '\n'.join(lines) + '\n'
+
+    def _append_json(self, record: Dict):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def finish(self):
+        """Stop progress reporting, print the summary line and write the metrics file"""
+        self.stop.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        print(self.progress_line(), flush=True)
+
+        if not self.path:
+            return
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if self.path.endswith('.prom'):
+            # Written whole and renamed so a textfile collector never reads a partial file
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w') as f:
+                f.write(self.prometheus())
+            os.replace(temp_path, self.path)
+        else:
+            self._append_json(self.snapshot())
+
+# One registry per process, shared by every module a script imports
+METRICS = Metrics.from_env()
@@ -0,0 +1,112 @@
+import os
+import threading
+from typing import List, Tuple
+
+DEFAULT_JOURNAL_FILE = 'organize_journal.log'
+
+PLAN = 'PLAN'
+DONE = 'DONE'
+UNDONE = 'UNDONE'
+COMPLETE = 'COMPLETE'
+
+# (source_path, target_path, branch)
+Move = Tuple[str, str, str]
+
+class JournalState:
+    """What a journal file says about the moves of one organize run"""
+
+    def __init__(self):
+        self.planned: List[Move] = []
+        self.done: List[Move] = []
+        self.undone = set()
+        self.complete = False
+
+    def pending(self) -> List[Move]:
+        done = set(self.done)
+        return [move for move in self.planned if move not in done]
+
+    def applied(self) -> List[Move]:
+        """Moves that are done and not rolled back, in the order they happened"""
+        return [move for move in self.done if move not in self.undone]
+
+class MoveJournal:
+    """Append-only write-ahead journal of file moves.
+
+    The whole plan is written and fsynced before the first move; each finished
+    move appends a DONE record, fsynced every fsync_every records, so a crash
+    loses at most that many records, which resume then repairs by checking
+    the filesystem.
+    """
+
+    def __init__(self, path: str = DEFAULT_JOURNAL_FILE, fsync_every: int = 100):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.lock = threading.Lock()
+        self.unsynced = 0
+        self.file = None
+
+    @staticmethod
+    def load(path: str = DEFAULT_JOURNAL_FILE) -> JournalState:
+        state = JournalState()
+        if not os.path.exists(path):
+            state.complete = True
+            return state
+
+        with open(path, 'r') as f:
+            for line in f:
+                # A torn last line from a crash is ignored
+                if not line.endswith('\n'):
+                    break
+                record, *fields = line.rstrip('\n').split('\t')
+                if record == COMPLETE:
+                    state.complete = True
+                    continue
+                if len(fields) != 3:
+                    continue
+                move = tuple(fields)
+                if record == PLAN:
+                    state.planned.append(move)
+                elif record == DONE:
+                    state.done.append(move)
+                elif record == UNDONE:
+                    state.undone.add(move)
+        return state
+
+    def open(self, fresh: bool):
+        self.file = open(self.path, 'w' if fresh else 'a')
+
+    def _append(self, record: str, move: Move, sync: bool = False):
+        with self.lock:
+            self.file.write('\t'.join((record, *move)) + '\n')
+            self.unsynced += 1
+            if sync or self.unsynced >= self.fsync_every:
+                self._sync()
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def plan(self, moves: List[Move]):
+        with self.lock:
+            for move in moves:
+                self.file.write('\t'.join((PLAN, *move)) + '\n')
+            self._sync()
+
+    def done(self, move: Move):
+        self._append(DONE, move)
+
+    def undone(self, move: Move):
+        self._append(UNDONE, move)
+
+    def complete(self):
+        with self.lock:
+            self.file.write(f"{COMPLETE}\n")
+            self._sync()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self._sync()
+                self.file.close()
+                self.file = None
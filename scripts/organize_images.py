@@ -1,128 +1,376 @@
 import os
 import re
 import shutil
+from bisect import bisect_right
+from collections import Counter
 from datetime import datetime
-import subprocess
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from move_journal import MoveJournal, DEFAULT_JOURNAL_FILE
+from image_dedup import resolve_references
+from image_store import ImageStore
+from metrics import METRICS
+from range_manifest import RangeManifest, RANGE_MANIFEST_FILE, load_ranges
 
-def get_remote_branches():
-    """Get list of remote branches with ranges"""
-    result = subprocess.run(['git', 'branch', '-r'], capture_output=True, text=True)
-    branches = result.stdout.strip().split('\n')
-    
-    # Extract range information from branch names
-    range_patterns = []
-    for branch in branches:
-        branch = branch.strip()
-        if 'origin/' in branch and '_to_' in branch:
-            # Extract range numbers from branch name
-            match = re.search(r'(\d+)_to_(\d+)$', branch)
-            if match:
-                start, end = map(int, match.groups())
-                range_patterns.append({
-                    'start': start,
-                    'end': end,
-                    'branch': branch.replace('origin/', '')
-                })
-    
-    return range_patterns
+# How to pick between overlapping range branches: 'first' (lowest start),
+# 'latest' (highest start) or 'narrowest' (smallest span)
+OVERLAP_POLICY = os.environ.get('RANGE_OVERLAP_POLICY', 'first')
 
-def get_image_number(filename):
-    """Extract number from image filename (e.g., s89120.jpg -> 89120)"""
-    match = re.search(r'[a-z](\d+)\.jpg$', filename.lower())
+OVERLAP_POLICIES = {
+    'first': lambda r: (r['start'], r['end']),
+    'latest': lambda r: (-r['start'], r['end']),
+    'narrowest': lambda r: (r['end'] - r['start'], r['start']),
+}
+
+class RangeIndex:
+    """Sorted, non-overlapping segment index over range branches.
+
+    Range boundaries split the number line into segments; each segment is
+    assigned the winning covering range under the overlap policy, so lookup
+    is a single bisect.
+    """
+
+    def __init__(self, range_patterns, policy=OVERLAP_POLICY):
+        if policy not in OVERLAP_POLICIES:
+            raise ValueError(f"Unknown overlap policy: {policy}")
+        self.ranges = sorted(range_patterns, key=lambda r: (r['start'], r['end']))
+        rank = OVERLAP_POLICIES[policy]
+
+        boundaries = sorted({r['start'] for r in self.ranges} | {r['end'] + 1 for r in self.ranges})
+        self.starts = []
+        self.segments = []
+        active = []
+        next_range = 0
+        for seg_start, seg_end in zip(boundaries, boundaries[1:]):
+            # Sweep: add ranges starting here, drop ranges that ended before this segment
+            while next_range < len(self.ranges) and self.ranges[next_range]['start'] <= seg_start:
+                active.append(self.ranges[next_range])
+                next_range += 1
+            active = [r for r in active if r['end'] >= seg_start]
+
+            winner = min(active, key=rank) if active else None
+            self.starts.append(seg_start)
+            self.segments.append((seg_start, seg_end - 1, winner))
+
+    def lookup(self, number):
+        """Return the range assigned to number, or None if it falls in a gap"""
+        position = bisect_right(self.starts, number) - 1
+        if position < 0:
+            return None
+        seg_start, seg_end, winner = self.segments[position]
+        return winner if number <= seg_end else None
+
+    def overlaps(self):
+        """Pairs of ranges whose spans intersect"""
+        pairs = []
+        for i, left in enumerate(self.ranges):
+            for right in self.ranges[i + 1:]:
+                if right['start'] > left['end']:
+                    break
+                pairs.append((left, right))
+        return pairs
+
+    def gaps(self):
+        """(start, end) spans between the lowest and highest range not covered by any branch"""
+        return [(seg_start, seg_end) for seg_start, seg_end, winner in self.segments if winner is None]
+
+    def report(self):
+        overlaps = self.overlaps()
+        gaps = self.gaps()
+        print(f"Range index: {len(self.ranges)} branches, {len(overlaps)} overlaps, {len(gaps)} gaps")
+        for left, right in overlaps:
+            print(f"  Overlap: {left['branch']} and {right['branch']}")
+        for start, end in gaps:
+            print(f"  Gap: {start} to {end}")
+
+# Prefix and number in one match (e.g., s89120.jpg -> s, 89120)
+IMAGE_FILENAME = re.compile(r'^([a-z])(\d+)\.jpg$')
+
+MOVE_WORKERS = int(os.environ.get('ORGANIZE_WORKERS', 8))
+JOURNAL_FILE = os.environ.get('ORGANIZE_JOURNAL', DEFAULT_JOURNAL_FILE)
+
+def parse_image_filename(filename):
+    """Extract (prefix, number) from an image filename, or None if it does not match"""
+    match = IMAGE_FILENAME.match(filename.lower())
     if match:
-        return int(match.group(1))
+        return match.group(1), int(match.group(2))
     return None
 
+def get_image_number(filename):
+    """Extract number from image filename (e.g., s89120.jpg -> 89120)"""
+    parsed = parse_image_filename(filename)
+    return parsed[1] if parsed else None
+
 def get_image_prefix(filename):
     """Extract prefix from image filename (e.g., s89120.jpg -> s)"""
-    match = re.search(r'^([a-z])\d+\.jpg$', filename.lower())
-    if match:
-        return match.group(1)
-    return None
+    parsed = parse_image_filename(filename)
+    return parsed[0] if parsed else None
 
-def organize_images(dry_run=False):
-    # Get all range patterns from remote branches
-    range_patterns = get_remote_branches()
-    
-    # Get current date in YYYYMMDD format
-    today = datetime.now().strftime('%Y%m%d')
+def plan_moves(range_index, today, stats):
+    """Phase one: a single scandir pass over every images_* folder, returning planned moves"""
+    moves = []
     
-    # Find all image folders in root directory
-    image_folders = [f for f in os.listdir('.') if f.startswith('images_') and os.path.isdir(f)]
-    
-    # Track statistics and moved files
-    stats = {'processed': 0, 'moved': 0, 'errors': 0}
-    moved_files = []
+    with os.scandir('.') as root:
+        image_folders = [entry.name for entry in root if entry.name.startswith('images_') and entry.is_dir()]
     
     for folder in image_folders:
         print(f"\nProcessing folder: {folder}")
         
-        # Process each image in the folder
-        for filename in os.listdir(folder):
-            if not filename.lower().endswith('.jpg'):
-                continue
-                
-            stats['processed'] += 1
-            
-            # Extract number and prefix from filename
-            number = get_image_number(filename)
-            prefix = get_image_prefix(filename)
-            
-            if not number or not prefix:
-                print(f"Skipping invalid filename: {filename}")
-                stats['errors'] += 1
-                continue
-            
-            # Find matching range
-            matching_range = None
-            for range_pattern in range_patterns:
-                if range_pattern['start'] <= number <= range_pattern['end']:
-                    matching_range = range_pattern
-                    break
-            
-            if matching_range:
-                # Create target folder name
-                target_folder = f"images_{prefix}_{today}_{matching_range['start']}_to_{matching_range['end']}"
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                filename = entry.name
+                if not filename.lower().endswith('.jpg') or not entry.is_file():
+                    continue
                 
-                # Create target folder if it doesn't exist
-                os.makedirs(target_folder, exist_ok=True)
+                stats['processed'] += 1
                 
-                # Source and target paths
-                source_path = os.path.join(folder, filename)
-                target_path = os.path.join(target_folder, filename)
+                parsed = parse_image_filename(filename)
+                if not parsed or not parsed[1]:
+                    print(f"Skipping invalid filename: {filename}")
+                    stats['errors'] += 1
+                    continue
+                prefix, number = parsed
                 
-                try:
-                    if not dry_run:
-                        shutil.move(source_path, target_path)
-                    stats['moved'] += 1
-                    print(f"{'Would move' if dry_run else 'Moved'} {filename} to {target_folder}")
-                    
-                    # Record the move operation
-                    moved_files.append((
-                        target_path,
-                        matching_range['branch'],
-                        source_path
-                    ))
-                except Exception as e:
-                    print(f"Error moving {filename}: {e}")
+                # Find matching range
+                matching_range = range_index.lookup(number)
+                if not matching_range:
+                    print(f"No matching range found for {filename}")
                     stats['errors'] += 1
-            else:
-                print(f"No matching range found for {filename}")
-                stats['errors'] += 1
+                    continue
+                
+                target_folder = f"images_{prefix}_{today}_{matching_range['start']}_to_{matching_range['end']}"
+                moves.append((
+                    os.path.join(folder, filename),
+                    os.path.join(target_folder, filename),
+                    matching_range['branch']
+                ))
     
-    # Write moved files to tracking file
-    if not dry_run and moved_files:
-        with open('moved_files.txt', 'w') as f:
-            for target, branch, source in moved_files:
-                f.write(f"{target}\t{branch}\t{source}\n")
+    return moves
+
+MOVED_FILES = 'moved_files.txt'
+
+def moved_line(move):
+    source_path, target_path, branch = move
+    return f"{target_path}\t{branch}\t{source_path}\n"
+
+def write_moved_files(moves):
+    """Rewrite the tracking file of completed moves from the journal"""
+    with open(MOVED_FILES, 'w') as f:
+        f.writelines(moved_line(move) for move in moves)
+
+def execute_moves(moves, journal, stats, tracking_mode='w'):
+    """Phase two: create each target folder once, then move in parallel, journaling each move.
+
+    Each move is appended to moved_files.txt as its DONE record is written, so
+    an interrupted run leaves the file matching the journal. tracking_mode 'w'
+    starts the file afresh on the first move, 'a' extends it.
+    """
+    target_folders = {os.path.dirname(target_path) for _, target_path, _ in moves}
+    for target_folder in target_folders:
+        os.makedirs(target_folder, exist_ok=True)
     
-    # Print summary
+    # A plain rename is enough when source and target share a filesystem
+    device = os.stat('.').st_dev
+    same_filesystem = {
+        folder: os.stat(folder).st_dev == device
+        for folder in {os.path.dirname(source_path) for source_path, _, _ in moves}
+        if os.path.isdir(folder)
+    }
+    lock = threading.Lock()
+    tracking = None
+    
+    def move(planned):
+        nonlocal tracking
+        source_path, target_path, branch = planned
+        try:
+            with METRICS.phase('move'):
+                if same_filesystem.get(os.path.dirname(source_path)):
+                    os.rename(source_path, target_path)
+                else:
+                    shutil.move(source_path, target_path)
+        except Exception as e:
+            print(f"Error moving {os.path.basename(source_path)}: {e}")
+            METRICS.inc('errors')
+            with lock:
+                stats['errors'] += 1
+            return
+        finally:
+            METRICS.advance()
+        
+        journal.done(planned)
+        METRICS.inc('moved')
+        METRICS.detail(f"Moved {os.path.basename(source_path)} to {os.path.dirname(target_path)}")
+        with lock:
+            if tracking is None:
+                tracking = open(MOVED_FILES, tracking_mode)
+            tracking.write(moved_line(planned))
+            stats['moved'] += 1
+    
+    METRICS.start(len(moves))
+    try:
+        with ThreadPoolExecutor(max_workers=MOVE_WORKERS) as executor:
+            list(executor.map(move, moves))
+    finally:
+        if tracking is not None:
+            tracking.close()
+    METRICS.finish()
+
+def record_moves(moves, undone=False):
+    """Add the images moved into each branch's folders to the range manifest, or take back undone ones"""
+    counts = Counter(branch for _, _, branch in moves)
+    prefixes = {}
+    for _, target_path, branch in moves:
+        prefixes.setdefault(branch, set()).add(get_image_prefix(os.path.basename(target_path)))
+    with RangeManifest.transaction(RANGE_MANIFEST_FILE) as manifest:
+        for branch, count in counts.items():
+            manifest.add_images(branch, [] if undone else prefixes[branch], -count if undone else count)
+
+def print_summary(stats, dry_run=False):
     print("\nOrganization complete!")
     print(f"Total files processed: {stats['processed']}")
     print(f"Files {'to be moved' if dry_run else 'moved'}: {stats['moved']}")
     print(f"Errors: {stats['errors']}")
 
+def organize_images(dry_run=False):
+    state = MoveJournal.load(JOURNAL_FILE)
+    if not state.complete and not dry_run:
+        print(f"Unfinished run recorded in {JOURNAL_FILE}; run with 'resume' or 'rollback' first")
+        return False
+    
+    # Get all range patterns from the range manifest
+    range_patterns = load_ranges()
+    range_index = RangeIndex(range_patterns)
+    range_index.report()
+    
+    # Get current date in YYYYMMDD format
+    today = datetime.now().strftime('%Y%m%d')
+    
+    if not dry_run:
+        # Branches only carry .jpg files, so duplicates stored as references are materialised first
+        store = ImageStore.from_env()
+        with os.scandir('.') as root:
+            for entry in root:
+                if entry.name.startswith('images_') and entry.is_dir():
+                    resolve_references(entry.name, store)
+        if store:
+            store.close()
+    
+    # Track statistics
+    stats = {'processed': 0, 'moved': 0, 'errors': 0}
+    moves = plan_moves(range_index, today, stats)
+    
+    if dry_run:
+        for source_path, target_path, branch in moves:
+            print(f"Would move {os.path.basename(source_path)} to {os.path.dirname(target_path)}")
+        stats['moved'] = len(moves)
+        print_summary(stats, dry_run)
+        return True
+    
+    # The full plan is on disk before anything moves
+    journal = MoveJournal(JOURNAL_FILE)
+    journal.open(fresh=True)
+    try:
+        journal.plan(moves)
+        execute_moves(moves, journal, stats)
+        journal.complete()
+    finally:
+        journal.close()
+    
+    applied = MoveJournal.load(JOURNAL_FILE).applied()
+    if applied:
+        record_moves(applied)
+    
+    print_summary(stats)
+    return True
+
+def resume_organize():
+    """Finish the moves of an interrupted run without rescanning the image folders"""
+    state = MoveJournal.load(JOURNAL_FILE)
+    if state.complete:
+        print("Nothing to resume")
+        return True
+    
+    journal = MoveJournal(JOURNAL_FILE)
+    journal.open(fresh=False)
+    stats = {'processed': len(state.planned), 'moved': len(state.done), 'errors': 0}
+    try:
+        remaining = []
+        for planned in state.pending():
+            source_path, target_path, _ = planned
+            if not os.path.exists(source_path) and os.path.exists(target_path):
+                # Moved before the crash but its record was not yet synced
+                journal.done(planned)
+                stats['moved'] += 1
+            else:
+                remaining.append(planned)
+        
+        print(f"Resuming {len(remaining)} of {len(state.planned)} planned moves")
+        execute_moves(remaining, journal, stats, tracking_mode='a')
+        journal.complete()
+    finally:
+        journal.close()
+    
+    applied = MoveJournal.load(JOURNAL_FILE).applied()
+    if applied:
+        write_moved_files(applied)
+        record_moves(applied)
+    
+    print_summary(stats)
+    return True
+
+def rollback_organize():
+    """Undo the moves recorded in the journal, newest first"""
+    state = MoveJournal.load(JOURNAL_FILE)
+    applied = state.applied()
+    
+    # Include moves that happened but whose records were lost in a crash
+    recorded = set(applied)
+    for planned in state.pending():
+        source_path, target_path, _ = planned
+        if planned not in recorded and not os.path.exists(source_path) and os.path.exists(target_path):
+            applied.append(planned)
+    
+    journal = MoveJournal(JOURNAL_FILE)
+    journal.open(fresh=False)
+    restored = errors = 0
+    undone = []
+    try:
+        for planned in reversed(applied):
+            source_path, target_path, _ = planned
+            try:
+                os.makedirs(os.path.dirname(source_path), exist_ok=True)
+                shutil.move(target_path, source_path)
+            except Exception as e:
+                print(f"Error restoring {os.path.basename(source_path)}: {e}")
+                errors += 1
+                continue
+            journal.undone(planned)
+            undone.append(planned)
+            restored += 1
+        journal.complete()
+    finally:
+        journal.close()
+    
+    # Remove target folders emptied by the rollback
+    for folder in {os.path.dirname(target_path) for _, target_path, _ in applied}:
+        if os.path.isdir(folder) and not os.listdir(folder):
+            os.rmdir(folder)
+    
+    # Only a completed run had its moves added to the manifest
+    if undone and state.complete:
+        record_moves(undone, undone=True)
+    write_moved_files(MoveJournal.load(JOURNAL_FILE).applied())
+    
+    print(f"\nRollback complete! Restored: {restored}, Errors: {errors}")
+    return errors == 0
+
 if __name__ == "__main__":
-    dry_run = len(sys.argv) > 1 and sys.argv[1].lower() == 'true'
-    organize_images(dry_run) 
\ No newline at end of file
+    mode = sys.argv[1].lower() if len(sys.argv) > 1 else ''
+    if mode == 'resume':
+        success = resume_organize()
+    elif mode == 'rollback':
+        success = rollback_organize()
+    else:
+        success = organize_images(mode == 'true')
+    sys.exit(0 if success else 1)
@@ -0,0 +1,274 @@
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# An archive is two append-only files: {name}.pack holds the concatenated image
+# bytes, {name}.idx a header plus one fixed-width record per image.
+INDEX_MAGIC = b'FGOPACK1'
+# code (NUL padded), offset, length, raw SHA-256
+RECORD = struct.Struct('<16sQI32s')
+COPY_CHUNK_SIZE = 1024 * 1024
+
+def pack_paths(path: str) -> Tuple[str, str]:
+    base = path[:-5] if path.endswith('.pack') else path
+    return base + '.pack', base + '.idx'
+
+def read_index(index_path: str, pack_size: int) -> List[Tuple[str, int, int, str]]:
+    """(code, offset, length, sha256 hex) records, ignoring any a crash left torn"""
+    with open(index_path, 'rb') as f:
+        data = f.read()
+    if data[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+        raise ValueError(f"Not a pack index: {index_path}")
+
+    records = []
+    body = len(data) - len(INDEX_MAGIC)
+    for position in range(len(INDEX_MAGIC), len(INDEX_MAGIC) + body - body % RECORD.size, RECORD.size):
+        code, offset, length, digest = RECORD.unpack_from(data, position)
+        # The blob is written before its record, so a record past the end is torn
+        if offset + length > pack_size:
+            break
+        records.append((code.rstrip(b'\0').decode('ascii'), offset, length, digest.hex()))
+    return records
+
+def count(path: str) -> int:
+    """Number of images in a pack, from the index size alone"""
+    index_path = pack_paths(path)[1]
+    return max(0, (os.path.getsize(index_path) - len(INDEX_MAGIC)) // RECORD.size)
+
+def repair(path: str):
+    """Cut a pack and its index back to the last whole record, dropping what a crash left torn.
+
+    Appending after a partial index record would misalign every later record,
+    and bytes past the last record's blob belong to no record.
+    """
+    pack_path, index_path = pack_paths(path)
+    pack_size = os.path.getsize(pack_path) if os.path.exists(pack_path) else 0
+    if not os.path.exists(index_path):
+        if pack_size:
+            raise ValueError(f"Pack without an index: {pack_path}")
+        return
+
+    index_size = os.path.getsize(index_path)
+    if index_size < len(INDEX_MAGIC):
+        # Crashed while writing the header, so no record can exist; the writer rewrites it
+        records, index_end = [], 0
+    else:
+        records = read_index(index_path, pack_size)
+        index_end = len(INDEX_MAGIC) + len(records) * RECORD.size
+    pack_end = max((offset + length for _, offset, length, _ in records), default=0)
+    if index_size > index_end:
+        os.truncate(index_path, index_end)
+    if pack_size > pack_end:
+        os.truncate(pack_path, pack_end)
+
+class PackWriter:
+    """Thread-safe appender: image bytes go to the pack, then a record to the index"""
+
+    def __init__(self, path: str):
+        self.pack_path, self.index_path = pack_paths(path)
+        directory = os.path.dirname(self.pack_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        repair(path)
+        self.lock = threading.Lock()
+        self.pack = open(self.pack_path, 'ab')
+        new_index = not os.path.exists(self.index_path) or os.path.getsize(self.index_path) == 0
+        self.index = open(self.index_path, 'ab')
+        if new_index:
+            self.index.write(INDEX_MAGIC)
+            self.index.flush()
+
+    def _record(self, code: str) -> bytes:
+        encoded = code.encode('ascii')
+        if len(encoded) > 16:
+            raise ValueError(f"Code too long for pack index: {code}")
+        return encoded
+
+    def add(self, code: str, data: bytes, sha: Optional[str] = None) -> Tuple[int, int]:
+        """Append one image and return its (offset, length)"""
+        encoded = self._record(code)
+        digest = bytes.fromhex(sha) if sha else hashlib.sha256(data).digest()
+
+        with self.lock:
+            offset = self.pack.seek(0, os.SEEK_END)
+            self.pack.write(data)
+            self.pack.flush()
+            self.index.write(RECORD.pack(encoded, offset, len(data), digest))
+            self.index.flush()
+        return offset, len(data)
+
+    def add_file(self, code: str, path: str, sha: Optional[str] = None) -> Tuple[int, int]:
+        """Append one image file, copied in chunks so memory stays flat for large files"""
+        encoded = self._record(code)
+        digest = hashlib.sha256()
+        length = 0
+
+        with self.lock, open(path, 'rb') as f:
+            offset = self.pack.seek(0, os.SEEK_END)
+            for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+                if not sha:
+                    digest.update(chunk)
+                self.pack.write(chunk)
+                length += len(chunk)
+            self.pack.flush()
+            raw = bytes.fromhex(sha) if sha else digest.digest()
+            self.index.write(RECORD.pack(encoded, offset, length, raw))
+            self.index.flush()
+        return offset, length
+
+    def close(self):
+        with self.lock:
+            for f in (self.pack, self.index):
+                os.fsync(f.fileno())
+                f.close()
+
+class PackReader:
+    """Zero-copy reader: images are memoryview slices of the memory-mapped pack"""
+
+    def __init__(self, path: str):
+        self.pack_path, self.index_path = pack_paths(path)
+        self.file = open(self.pack_path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        # mmap cannot map an empty file
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self.view = memoryview(self.map) if self.map else memoryview(b'')
+        self.records = read_index(self.index_path, size)
+        # Later records win, so re-adding a code replaces it
+        self.by_code: Dict[str, Tuple[int, int, str]] = {
+            code: (offset, length, sha) for code, offset, length, sha in self.records
+        }
+
+    def __len__(self) -> int:
+        return len(self.by_code)
+
+    def __contains__(self, code: str) -> bool:
+        return code in self.by_code
+
+    def codes(self) -> List[str]:
+        return list(self.by_code)
+
+    def sha256(self, code: str) -> str:
+        return self.by_code[code][2]
+
+    def get(self, code: str) -> memoryview:
+        offset, length, _ = self.by_code[code]
+        return self.view[offset:offset + length]
+
+    def __iter__(self) -> Iterator[Tuple[str, memoryview]]:
+        for code, (offset, length, _) in self.by_code.items():
+            yield code, self.view[offset:offset + length]
+
+    def verify(self) -> List[str]:
+        """Codes whose bytes no longer match the recorded hash"""
+        return [code for code, data in self if hashlib.sha256(data).hexdigest() != self.sha256(code)]
+
+    def close(self):
+        self.view.release()
+        if self.map:
+            try:
+                self.map.close()
+            except BufferError:
+                # Slices still held by callers keep the mapping alive until they are dropped
+                pass
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class PackBackend:
+    """ImageStore backend keeping every object in one pack, keyed by SHA-256"""
+
+    def __init__(self, root: str):
+        self.path = os.path.join(root, 'objects.pack')
+        self.writer = PackWriter(self.path)
+        self.lock = threading.Lock()
+        self.reader = None
+        self.objects: Dict[str, Tuple[int, int]] = {
+            sha: (offset, length)
+            for _, offset, length, sha in read_index(self.writer.index_path, os.path.getsize(self.writer.pack_path))
+        }
+
+    def exists(self, sha: str) -> bool:
+        return sha in self.objects
+
+    def put_file(self, sha: str, source_path: str):
+        with self.lock:
+            if sha in self.objects:
+                return
+            self.objects[sha] = self.writer.add_file(sha[:16], source_path, sha)
+
+    def _view(self, sha: str) -> memoryview:
+        with self.lock:
+            offset, length = self.objects[sha]
+            # Re-map once appends have grown the pack past the current mapping
+            if self.reader is None or offset + length > len(self.reader.view):
+                if self.reader:
+                    self.reader.close()
+                self.reader = PackReader(self.path)
+            return self.reader.view[offset:offset + length]
+
+    def get(self, sha: str) -> bytes:
+        return bytes(self._view(sha))
+
+    def export(self, sha: str, target_path: str):
+        with open(target_path, 'wb') as f:
+            f.write(self._view(sha))
+
+    def close(self):
+        with self.lock:
+            if self.reader:
+                self.reader.close()
+            self.writer.close()
+
+def usage():
+    print("Usage: python pack_file.py pack <pack_file> <image_folder>...")
+    print("       python pack_file.py unpack <pack_file> <output_folder>")
+    print("       python pack_file.py list|count|verify <pack_file>")
+    sys.exit(1)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        usage()
+
+    command, path = sys.argv[1], sys.argv[2]
+
+    if command == 'pack' and len(sys.argv) > 3:
+        writer = PackWriter(path)
+        packed = 0
+        for folder in sys.argv[3:]:
+            for name in sorted(os.listdir(folder)):
+                code, ext = os.path.splitext(name)
+                if ext.lower() == '.jpg':
+                    writer.add_file(code, os.path.join(folder, name))
+                    packed += 1
+        writer.close()
+        print(f"Packed {packed} images into {pack_paths(path)[0]}")
+    elif command == 'unpack' and len(sys.argv) == 4:
+        os.makedirs(sys.argv[3], exist_ok=True)
+        with PackReader(path) as reader:
+            for code, data in reader:
+                with open(os.path.join(sys.argv[3], f"{code}.jpg"), 'wb') as f:
+                    f.write(data)
+            print(f"Unpacked {len(reader)} images")
+    elif command == 'list':
+        with PackReader(path) as reader:
+            for code in reader.codes():
+                print(code)
+    elif command == 'count':
+        print(count(path))
+    elif command == 'verify':
+        with PackReader(path) as reader:
+            bad = reader.verify()
+            for code in bad:
+                print(f"Hash mismatch: {code}")
+            print(f"Verified {len(reader)} images, {len(bad)} corrupt")
+        sys.exit(1 if bad else 0)
+    else:
+        usage()
@@ -0,0 +1,222 @@
+import fcntl
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+DEFAULT_MANIFEST_FILE = os.path.join('input', 'range_manifest.json')
+RANGE_MANIFEST_FILE = os.environ.get('RANGE_MANIFEST_FILE', DEFAULT_MANIFEST_FILE)
+
+BRANCH_PATTERN = re.compile(r'^(\d+)_to_(\d+)$')
+
+# Progress cursors the workflows keep in their own files; read when the manifest has none yet
+LEGACY_CURSOR_FILES = {
+    'download': os.path.join('input', 'range.json'),
+    'organize': os.path.join('input', 'organize_range.json'),
+    'valid_codes': os.path.join('input', 'valid_codes_range.json'),
+}
+
+def _now() -> str:
+    return datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+
+class RangeManifest:
+    """Every range branch with its prefixes, image count and last seen head SHA, plus stage cursors.
+
+    The whole manifest is one small JSON file read in a single load. It
+    also keeps a fingerprint of the remote refs it was last rebuilt from,
+    so a rebuild can tell when branches were pushed or deleted since. Stages
+    change it inside transaction(), which holds a lock and replaces the
+    file atomically.
+    """
+
+    def __init__(self, path: str = RANGE_MANIFEST_FILE, data: Optional[Dict] = None):
+        self.path = path
+        data = data or {}
+        self.ranges: Dict[str, Dict] = data.get('ranges', {})
+        self.cursors: Dict[str, Dict] = data.get('cursors', {})
+        self.refs: Optional[str] = data.get('refs')
+
+    @classmethod
+    def load(cls, path: str = RANGE_MANIFEST_FILE) -> 'RangeManifest':
+        if not os.path.exists(path):
+            return cls(path)
+        with open(path, 'r') as f:
+            return cls(path, json.load(f))
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump({'updated_at': _now(), 'ranges': self.ranges, 'cursors': self.cursors, 'refs': self.refs},
+                      f, indent=1, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+    @classmethod
+    @contextmanager
+    def transaction(cls, path: str = RANGE_MANIFEST_FILE):
+        """Load under an exclusive lock, yield the manifest and save it if the block succeeds"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(f"{path}.lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                manifest = cls.load(path)
+                yield manifest
+                manifest.save()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def branches(self) -> List[Dict]:
+        """Ranges as {'start', 'end', 'branch', 'sha'} dicts, the shape get_remote_branches returned"""
+        return [{'start': entry['start'], 'end': entry['end'], 'branch': branch, 'sha': entry.get('sha')}
+                for branch, entry in sorted(self.ranges.items(), key=lambda item: item[1]['start'])]
+
+    def upsert(self, branch: str, sha: Optional[str] = None) -> Dict:
+        match = BRANCH_PATTERN.match(branch)
+        if not match:
+            raise ValueError(f"Not a range branch: {branch}")
+        entry = self.ranges.setdefault(branch, {
+            'start': int(match.group(1)), 'end': int(match.group(2)), 'prefixes': [], 'images': 0, 'sha': None,
+        })
+        if sha:
+            entry['sha'] = sha
+        entry['updated_at'] = _now()
+        return entry
+
+    def set_images(self, branch: str, prefixes: Iterable[str], count: int, sha: Optional[str] = None):
+        """Record the full contents of a branch, as seen by listing it"""
+        entry = self.upsert(branch, sha)
+        entry['prefixes'] = sorted(set(prefixes))
+        entry['images'] = count
+
+    def add_images(self, branch: str, prefixes: Iterable[str], count: int):
+        """Record images added to a branch by a stage that does not list the whole branch"""
+        entry = self.upsert(branch)
+        entry['prefixes'] = sorted(set(entry['prefixes']) | set(prefixes))
+        entry['images'] = max(0, entry['images'] + count)
+
+    def retain(self, branches: Iterable[str]):
+        """Drop ranges whose branch no longer exists"""
+        keep = set(branches)
+        for branch in list(self.ranges):
+            if branch not in keep:
+                del self.ranges[branch]
+
+    def cursor(self, stage: str) -> Optional[Dict]:
+        if stage in self.cursors:
+            return self.cursors[stage]
+        legacy = LEGACY_CURSOR_FILES.get(stage)
+        if legacy and os.path.exists(legacy):
+            with open(legacy, 'r') as f:
+                return json.load(f)
+        return None
+
+    def set_cursor(self, stage: str, start: int, end: int):
+        """Move a stage's cursor, keeping its legacy file in step for workflows that still read it"""
+        self.cursors[stage] = {'start': start, 'end': end}
+        legacy = LEGACY_CURSOR_FILES.get(stage)
+        if legacy and os.path.isdir(os.path.dirname(legacy) or '.'):
+            with open(legacy, 'w') as f:
+                json.dump(self.cursors[stage], f)
+
+def git_branches() -> List[Dict]:
+    """Range branches and their head SHAs from the remote-tracking refs"""
+    result = subprocess.run(
+        ['git', 'for-each-ref', '--format=%(refname:short) %(objectname)', 'refs/remotes/origin/'],
+        capture_output=True, text=True
+    )
+    branches = []
+    for line in result.stdout.splitlines():
+        ref, _, sha = line.strip().partition(' ')
+        branch = ref.replace('origin/', '', 1)
+        match = BRANCH_PATTERN.match(branch)
+        if match:
+            branches.append({'start': int(match.group(1)), 'end': int(match.group(2)), 'branch': branch,
+                             'sha': sha or None})
+    return branches
+
+def refs_fingerprint(branches: List[Dict]) -> Optional[str]:
+    """Count and hash of the range branches' names and head SHAs; changes with any push or deletion"""
+    if not branches:
+        return None
+    heads = '\n'.join(sorted(f"{branch['branch']} {branch['sha']}" for branch in branches))
+    return f"{len(branches)}:{hashlib.sha1(heads.encode()).hexdigest()}"
+
+def rebuild_from_git(path: str = RANGE_MANIFEST_FILE, branches: Optional[List[Dict]] = None) -> RangeManifest:
+    """Refresh the manifest's range list and head SHAs from git, keeping recorded counts"""
+    if branches is None:
+        branches = git_branches()
+    with RangeManifest.transaction(path) as manifest:
+        for branch in branches:
+            manifest.upsert(branch['branch'], branch['sha'])
+        if branches:
+            manifest.retain(branch['branch'] for branch in branches)
+            manifest.refs = refs_fingerprint(branches)
+    return manifest
+
+def load_ranges(path: str = RANGE_MANIFEST_FILE, verify: bool = False) -> List[Dict]:
+    """Ranges from the manifest in one JSON read, rebuilt from git refs only when it has none.
+
+    The branch workflows upsert the manifest as they push, so it is trusted
+    as committed and 'sha' is None for callers to revalidate. With verify the
+    remote refs are fingerprinted and the manifest rebuilt if they changed,
+    returning the live head SHAs.
+    """
+    manifest = RangeManifest.load(path)
+    if manifest.ranges and not verify:
+        return [dict(branch, sha=None) for branch in manifest.branches()]
+
+    branches = git_branches()
+    if not branches:
+        if not manifest.ranges:
+            print(f"No ranges in {path} and no range branches in git")
+        return [dict(branch, sha=None) for branch in manifest.branches()]
+
+    if manifest.refs != refs_fingerprint(branches):
+        print(f"Range branches changed since {path} was built, rebuilding from git refs")
+        manifest = rebuild_from_git(path, branches)
+    return manifest.branches()
+
+def usage():
+    print("Usage: python range_manifest.py rebuild|show")
+    print("       python range_manifest.py upsert <branch> [sha]")
+    print("       python range_manifest.py cursor <stage>")
+    print("       python range_manifest.py set-cursor <stage> <start_code> <end_code>")
+    sys.exit(1)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        usage()
+
+    command = sys.argv[1]
+    if command == 'rebuild':
+        manifest = rebuild_from_git()
+        print(f"{len(manifest.ranges)} ranges in {manifest.path}")
+    elif command == 'show':
+        manifest = RangeManifest.load()
+        for branch in manifest.branches():
+            entry = manifest.ranges[branch['branch']]
+            print(f"{branch['branch']}\t{','.join(entry['prefixes']) or '-'}\t{entry['images']}\t{entry.get('sha') or '-'}")
+    elif command == 'upsert' and len(sys.argv) in (3, 4):
+        # One branch pushed by a workflow that cannot see the other remote refs
+        with RangeManifest.transaction() as manifest:
+            manifest.upsert(sys.argv[2], sys.argv[3] if len(sys.argv) == 4 else None)
+    elif command == 'cursor' and len(sys.argv) == 3:
+        # Same JSON the legacy cursor files hold, for jq in the workflows
+        print(json.dumps(RangeManifest.load().cursor(sys.argv[2])))
+    elif command == 'set-cursor' and len(sys.argv) == 5:
+        stage, start, end = sys.argv[2], int(sys.argv[3]), int(sys.argv[4])
+        with RangeManifest.transaction() as manifest:
+            manifest.set_cursor(stage, start, end)
+    else:
+        usage()
@@ -0,0 +1,206 @@
+import json
+import os
+import re
+import string
+import sys
+from collections import defaultdict
+from datetime import datetime
+from glob import glob
+from typing import Dict, List, Optional, Set, Tuple
+from snapshot_store import latest_urls
+
+PREFIXES = string.ascii_lowercase
+
+BUCKET_SIZE = int(os.environ.get('PLANNER_BUCKET_SIZE', 100))
+# Warm buckets are merged into shards up to this size
+SHARD_SIZE = int(os.environ.get('PLANNER_SHARD_SIZE', 500))
+# Hot buckets (hits per code at or above this) are scanned in finer shards
+HOT_DENSITY = float(os.environ.get('PLANNER_HOT_DENSITY', 0.2))
+HOT_SHARD_SIZE = int(os.environ.get('PLANNER_HOT_SHARD_SIZE', 50))
+# Codes probed per cold bucket, at an offset that rotates between runs
+COLD_SAMPLE_SIZE = int(os.environ.get('PLANNER_COLD_SAMPLE_SIZE', 10))
+# GitHub Actions caps a matrix at 256 jobs
+MAX_SHARDS = int(os.environ.get('PLANNER_MAX_SHARDS', 256))
+
+BRANCH_URL_PATTERN = re.compile(r'/refs/heads/(\d+)_to_(\d+)/.*/([a-z])(\d+)\.jpg$')
+CODE_PATTERN = re.compile(r'([a-z])(\d+)')
+EMPTY_RANGE_PATTERN = re.compile(r'No images found in range (\d+) to (\d+) with prefix ([a-z])')
+
+# "{prefix} {start} {end}" per shard the download workflow crawled while logging valid codes
+SCANNED_RANGES_FILE = os.path.join('valid_codes', 'scanned_ranges.txt')
+SCANNED_RANGE_PATTERN = re.compile(r'^([a-z]) (\d+) (\d+)$')
+
+HOT = 'hot'
+WARM = 'warm'
+COLD = 'cold'
+UNKNOWN = 'unknown'
+
+class History:
+    """Hits per (prefix, bucket) and the spans already probed, gathered from existing logs"""
+
+    def __init__(self, bucket_size: int = BUCKET_SIZE):
+        self.bucket_size = bucket_size
+        self.hits: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        # Spans crawled for every prefix (range branches) and for one prefix (empty ranges)
+        self.all_probed: Set[Tuple[int, int]] = set()
+        self.probed: Dict[str, Set[Tuple[int, int]]] = defaultdict(set)
+        # Spans whose valid codes are already in the valid_codes logs
+        self.scanned: Dict[str, Set[Tuple[int, int]]] = defaultdict(set)
+
+    def add_hit(self, prefix: str, number: int):
+        self.hits[prefix][number // self.bucket_size] += 1
+
+    def load(self, root: str = '.'):
+        for url in latest_urls(os.path.join(root, 'image_urls')):
+            match = BRANCH_URL_PATTERN.search(url)
+            if match:
+                start, end, prefix, number = match.groups()
+                self.all_probed.add((int(start), int(end)))
+                self.add_hit(prefix, int(number))
+
+        for log_file in glob(os.path.join(root, 'valid_codes', '*.log')):
+            with open(log_file, 'r') as f:
+                for line in f:
+                    match = CODE_PATTERN.fullmatch(line.strip())
+                    if match:
+                        self.add_hit(match.group(1), int(match.group(2)))
+
+        empty_log = os.path.join(root, 'empty_ranges.log')
+        if os.path.exists(empty_log):
+            with open(empty_log, 'r') as f:
+                for line in f:
+                    match = EMPTY_RANGE_PATTERN.search(line)
+                    if match:
+                        start, end, prefix = match.groups()
+                        self.probed[prefix].add((int(start), int(end)))
+
+        scanned_log = os.path.join(root, SCANNED_RANGES_FILE)
+        if os.path.exists(scanned_log):
+            with open(scanned_log, 'r') as f:
+                for line in f:
+                    match = SCANNED_RANGE_PATTERN.match(line.strip())
+                    if match:
+                        prefix, start, end = match.group(1), int(match.group(2)), int(match.group(3))
+                        self.scanned[prefix].add((start, end))
+                        self.probed[prefix].add((start, end))
+        return self
+
+    def was_probed(self, prefix: str, start: int, end: int) -> bool:
+        """True when at least half of [start, end] lies in spans already crawled for prefix"""
+        covered = set()
+        for span_start, span_end in self.all_probed | self.probed[prefix]:
+            low, high = max(start, span_start), min(end, span_end)
+            if low <= high:
+                covered.update(range(low, high + 1))
+        return len(covered) * 2 >= end - start + 1
+
+    def classify(self, prefix: str, bucket: int, start: Optional[int] = None, end: Optional[int] = None) -> str:
+        """Kind of a bucket, judging coldness only over the part of it inside [start, end]"""
+        bucket_start = bucket * self.bucket_size
+        bucket_end = bucket_start + self.bucket_size - 1
+        hits = self.hits[prefix].get(bucket, 0)
+        if hits:
+            return HOT if hits / self.bucket_size >= HOT_DENSITY else WARM
+        # A window starting mid-bucket must not inherit coverage of the part it excludes
+        low = bucket_start if start is None else max(start, bucket_start)
+        high = bucket_end if end is None else min(end, bucket_end)
+        return COLD if self.was_probed(prefix, low, high) else UNKNOWN
+
+def plan(history: History, start: int, end: int, prefixes: str = PREFIXES, rotation: int = None) -> List[Dict]:
+    """Build the work list of {prefix, start, end} shards for [start, end]"""
+    size = history.bucket_size
+    if rotation is None:
+        rotation = datetime.now().timetuple().tm_yday
+    shards = []
+
+    for prefix in prefixes:
+        pending = None  # open warm/unknown shard being extended
+        for bucket in range(start // size, end // size + 1):
+            bucket_start = max(start, bucket * size)
+            bucket_end = min(end, bucket * size + size - 1)
+            kind = history.classify(prefix, bucket, bucket_start, bucket_end)
+
+            if kind in (WARM, UNKNOWN):
+                if pending and pending['end'] + 1 == bucket_start and bucket_end - pending['start'] < SHARD_SIZE:
+                    pending['end'] = bucket_end
+                else:
+                    pending = {'prefix': prefix, 'start': bucket_start, 'end': bucket_end}
+                    shards.append(pending)
+                continue
+
+            pending = None
+            if kind == HOT:
+                for shard_start in range(bucket_start, bucket_end + 1, HOT_SHARD_SIZE):
+                    shards.append({'prefix': prefix, 'start': shard_start,
+                                   'end': min(bucket_end, shard_start + HOT_SHARD_SIZE - 1)})
+            elif COLD_SAMPLE_SIZE > 0:
+                span = bucket_end - bucket_start + 1
+                offset = (rotation * COLD_SAMPLE_SIZE) % span
+                sample_start = bucket_start + offset
+                shards.append({'prefix': prefix, 'start': sample_start,
+                               'end': min(bucket_end, sample_start + COLD_SAMPLE_SIZE - 1)})
+
+    return shards
+
+def unscanned(history: History, start: int, end: int, prefixes: str = PREFIXES) -> List[Dict]:
+    """{prefix, start, end} spans of [start, end] whose valid codes no crawl has logged yet"""
+    spans = []
+    for prefix in prefixes:
+        position = start
+        for span_start, span_end in sorted(history.scanned[prefix]):
+            if span_end < position or span_start > end:
+                continue
+            if span_start > position:
+                spans.append({'prefix': prefix, 'start': position, 'end': span_start - 1})
+            position = max(position, span_end + 1)
+        if position <= end:
+            spans.append({'prefix': prefix, 'start': position, 'end': end})
+    return spans
+
+def coalesce(shards: List[Dict], max_shards: int = MAX_SHARDS) -> List[Dict]:
+    """Merge neighbouring shards of the same prefix, narrowest merged span first, until under max_shards"""
+    shards = sorted((dict(shard) for shard in shards), key=lambda s: (s['prefix'], s['start']))
+    while len(shards) > max_shards:
+        best = None
+        for i in range(len(shards) - 1):
+            left, right = shards[i], shards[i + 1]
+            if left['prefix'] != right['prefix']:
+                continue
+            span = right['end'] - left['start']
+            if best is None or span < best[0]:
+                best = (span, i)
+        if best is None:
+            break
+        i = best[1]
+        shards[i]['end'] = shards[i + 1]['end']
+        del shards[i + 1]
+    return shards
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == 'unscanned':
+        start_code, end_code = int(sys.argv[2]), int(sys.argv[3])
+        spans = unscanned(History().load(), start_code, end_code)
+        print(f"{len(spans)} spans not yet scanned for valid codes", file=sys.stderr)
+        # One job per prefix, since each job rewrites its prefix's whole log; a scanned gap between
+        # two unscanned spans is probed again rather than racing two jobs on one file
+        merged = {}
+        for span in spans:
+            merged.setdefault(span['prefix'], dict(span))['end'] = span['end']
+        print(json.dumps({'range': list(merged.values())}, separators=(',', ':')))
+        sys.exit(0)
+
+    if len(sys.argv) != 3:
+        print("Usage: python range_planner.py <start_code> <end_code>")
+        print("       python range_planner.py unscanned <start_code> <end_code>")
+        sys.exit(1)
+
+    start_code = int(sys.argv[1])
+    end_code = int(sys.argv[2])
+
+    shards = coalesce(plan(History().load(), start_code, end_code))
+    codes = sum(shard['end'] - shard['start'] + 1 for shard in shards)
+    full = (end_code - start_code + 1) * len(PREFIXES)
+    print(f"Planned {len(shards)} shards covering {codes} of {full} codes", file=sys.stderr)
+
+    # Same shape as the matrix the workflows build by hand
+    print(json.dumps({'range': shards}, separators=(',', ':')))
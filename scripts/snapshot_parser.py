@@ -0,0 +1,84 @@
+import re
+from typing import Dict, List, Tuple
+from metrics import METRICS
+
+# One image URL per line: scheme and host, the folder path, then {prefix}{number}.jpg.
+# Any other non-blank line matches the 'bad' branch so a single pass over the
+# buffer yields both the parsed rows and the lines to reject.
+LINE_PATTERN = re.compile(
+    r'^[ \t]*(?:'
+    r'(?P<url>https?://[^/\s]+(?P<folder>(?:/\S*)?)/(?P<code>(?P<prefix>[A-Za-z])(?P<number>[0-9]+))\.jpg)'
+    r'|(?P<bad>\S.*?))[ \t\r]*$',
+    re.MULTILINE
+)
+URL_PATTERN = re.compile(
+    r'https?://[^/\s]+(?P<folder>(?:/\S*)?)/(?P<code>(?P<prefix>[A-Za-z])(?P<number>[0-9]+))\.jpg'
+)
+
+class ParsedSnapshot:
+    """Columns parsed from a snapshot file, plus the (line number, text) of every rejected line"""
+
+    def __init__(self):
+        self.codes: List[str] = []
+        self.prefixes: List[str] = []
+        self.numbers: List[int] = []
+        self.folders: List[str] = []
+        self.urls: List[str] = []
+        self.rejected: List[Tuple[int, str]] = []
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def documents(self, **extra) -> List[Dict]:
+        """BSON-ready image documents, one per parsed row"""
+        return [
+            {'code': code, 'prefix': prefix, 'number': number, 'folder': folder, 'url': url, **extra}
+            for code, prefix, number, folder, url
+            in zip(self.codes, self.prefixes, self.numbers, self.folders, self.urls)
+        ]
+
+    def report(self, source: str, limit: int = 10):
+        if not self.rejected:
+            return
+        METRICS.inc('rejected', len(self.rejected))
+        print(f"Rejected {len(self.rejected)} malformed lines in {source}")
+        for line_number, text in self.rejected[:limit]:
+            print(f"  line {line_number}: {text[:200]}")
+
+def parse_snapshot(buffer: str) -> ParsedSnapshot:
+    """Parse a whole snapshot buffer with one regex pass into columns"""
+    parsed = ParsedSnapshot()
+    # findall returns (url, folder, code, prefix, number, bad) tuples without per-match objects
+    rows = LINE_PATTERN.findall(buffer)
+    good = [row for row in rows if row[2]]
+    if good:
+        urls, folders, codes, prefixes, numbers, _ = zip(*good)
+        parsed.urls, parsed.folders = list(urls), list(folders)
+        parsed.codes, parsed.prefixes = list(codes), list(prefixes)
+        parsed.numbers = list(map(int, numbers))
+
+    if len(good) != len(rows):
+        # Rare path: locate the malformed lines for the report
+        for match in LINE_PATTERN.finditer(buffer):
+            if match.group('bad') is not None:
+                parsed.rejected.append((buffer.count('\n', 0, match.start()) + 1, match.group('bad')))
+    return parsed
+
+def parse_image_url(url: str) -> Dict:
+    """Metadata of a single image URL, matched exactly as parse_snapshot matches a line"""
+    match = URL_PATTERN.fullmatch(url.strip())
+    if not match:
+        raise ValueError(f"Malformed image URL: {url}")
+    return {
+        'code': match.group('code'),
+        'prefix': match.group('prefix'),
+        'number': int(match.group('number')),
+        'folder': match.group('folder'),
+        'url': match.group(0)
+    }
+
+def parse_snapshot_file(path: str) -> ParsedSnapshot:
+    with open(path, 'r') as f:
+        parsed = parse_snapshot(f.read())
+    parsed.report(path)
+    return parsed
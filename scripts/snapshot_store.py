@@ -0,0 +1,200 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+from datetime import datetime
+from glob import glob
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_STORE_DIR = os.path.join('image_urls', 'store')
+# Write a full snapshot after this many consecutive deltas to bound read cost
+FULL_EVERY = 10
+
+# Any raw host (GITHUB_RAW_URL may point at a mirror or a local stub), then /{owner}/{repo}/refs/heads/
+URL_PATTERN = re.compile(r'^([a-z][a-z0-9+.-]*://.+?/[^/]+/[^/]+/refs/heads/)([^/]+)/(.+)/([^/]+)\.jpg$')
+
+Entry = Tuple[str, str, str]
+
+def parse_url(url: str) -> Optional[Tuple[str, Entry]]:
+    """Split a raw image URL into its shared base and a (branch, folder, code) entry"""
+    match = URL_PATTERN.match(url)
+    if not match:
+        return None
+    base, branch, folder, code = match.groups()
+    return base, (branch, folder, code)
+
+def build_url(base: str, entry: Entry) -> str:
+    branch, folder, code = entry
+    return f"{base}{branch}/{folder}/{code}.jpg"
+
+def _sort_key(entry: Entry):
+    # Same order fetch_branch_images.main writes: by file name, then branch
+    return entry[2].lower(), entry[0], entry[1]
+
+class SnapshotStore:
+    """Deduplicated store of image URL snapshots.
+
+    URLs are kept as a shared base plus (branch, folder, code) entries. A run
+    whose URL set matches the latest snapshot writes nothing; otherwise the
+    snapshot is stored as a delta against the previous one, with a full
+    snapshot every FULL_EVERY writes.
+    """
+
+    def __init__(self, root: str = DEFAULT_STORE_DIR):
+        self.root = root
+        self.index_path = os.path.join(root, 'index.json')
+        self.index: List[Dict] = []
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                self.index = json.load(f)
+
+    def snapshots(self) -> List[str]:
+        return [snapshot['name'] for snapshot in self.index]
+
+    def latest(self) -> Optional[Dict]:
+        return self.index[-1] if self.index else None
+
+    def write(self, urls: List[str], name: Optional[str] = None) -> Optional[str]:
+        """Store a snapshot of urls and return its name, or None if nothing changed"""
+        base = None
+        entries = set()
+        for url in urls:
+            parsed = parse_url(url)
+            if parsed is None:
+                raise ValueError(f"Unrecognised image URL: {url}")
+            url_base, entry = parsed
+            if base is not None and url_base != base:
+                raise ValueError(f"Snapshot mixes repositories: {url_base} and {base}")
+            base = url_base
+            entries.add(entry)
+
+        ordered = sorted(entries, key=_sort_key)
+        digest = hashlib.sha256('\n'.join('\t'.join(entry) for entry in ordered).encode()).hexdigest()
+
+        latest = self.latest()
+        if latest and latest['digest'] == digest:
+            return None
+
+        name = name or datetime.now().strftime('%Y%m%d_%H%M%S')
+        os.makedirs(self.root, exist_ok=True)
+
+        deltas_since_full = 0
+        for snapshot in reversed(self.index):
+            if snapshot['kind'] == 'full':
+                break
+            deltas_since_full += 1
+
+        if latest and latest['base'] == base and deltas_since_full < FULL_EVERY - 1:
+            previous = set(self._entries(len(self.index) - 1))
+            lines = ['+' + '\t'.join(entry) for entry in sorted(entries - previous, key=_sort_key)]
+            lines += ['-' + '\t'.join(entry) for entry in sorted(previous - entries, key=_sort_key)]
+            kind = 'delta'
+        else:
+            lines = ['\t'.join(entry) for entry in ordered]
+            kind = 'full'
+
+        filename = f"{name}.{kind}.gz"
+        with open(os.path.join(self.root, filename), 'wb') as f:
+            f.write(gzip.compress(('\n'.join(lines) + '\n').encode(), mtime=0))
+
+        self.index.append({
+            'name': name,
+            'kind': kind,
+            'file': filename,
+            'base': base,
+            'count': len(ordered),
+            'digest': digest,
+        })
+        self._save_index()
+        return name
+
+    def _save_index(self):
+        temp_path = f"{self.index_path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(temp_path, self.index_path)
+
+    def _read_lines(self, snapshot: Dict) -> List[str]:
+        with gzip.open(os.path.join(self.root, snapshot['file']), 'rt') as f:
+            return [line.rstrip('\n') for line in f if line.strip()]
+
+    def _entries(self, position: int) -> List[Entry]:
+        """Rebuild the entries of the snapshot at position from its last full snapshot"""
+        start = position
+        while self.index[start]['kind'] != 'full':
+            start -= 1
+
+        entries = set(tuple(line.split('\t')) for line in self._read_lines(self.index[start]))
+        for snapshot in self.index[start + 1:position + 1]:
+            for line in self._read_lines(snapshot):
+                entry = tuple(line[1:].split('\t'))
+                if line[0] == '+':
+                    entries.add(entry)
+                else:
+                    entries.discard(entry)
+
+        return sorted(entries, key=_sort_key)
+
+    def _position(self, name: Optional[str]) -> int:
+        if not self.index:
+            raise LookupError(f"Snapshot store {self.root} is empty")
+        if name is None:
+            return len(self.index) - 1
+        for position, snapshot in enumerate(self.index):
+            if snapshot['name'] == name:
+                return position
+        raise LookupError(f"Snapshot not found: {name}")
+
+    def entries(self, name: Optional[str] = None) -> List[Entry]:
+        """(branch, folder, code) entries of a snapshot, the latest by default"""
+        return self._entries(self._position(name))
+
+    def read(self, name: Optional[str] = None) -> List[str]:
+        """Full URL list of a snapshot, the latest by default"""
+        position = self._position(name)
+        base = self.index[position]['base']
+        return [build_url(base, entry) for entry in self._entries(position)]
+
+def latest_snapshot(root: str = 'image_urls') -> Optional[str]:
+    """Identifier of the snapshot latest_urls reads, for telling whether data derived from it is stale"""
+    latest = SnapshotStore(os.path.join(root, 'store')).latest()
+    if latest:
+        return f"store:{latest['name']}:{latest['digest']}"
+
+    snapshots = sorted(glob(os.path.join(root, 'branch_images_*.txt')))
+    return f"text:{os.path.basename(snapshots[-1])}" if snapshots else None
+
+def latest_urls(root: str = 'image_urls') -> List[str]:
+    """URLs of the newest snapshot, from the store if present, else the newest text snapshot"""
+    store = SnapshotStore(os.path.join(root, 'store'))
+    if store.latest():
+        return store.read()
+
+    snapshots = sorted(glob(os.path.join(root, 'branch_images_*.txt')))
+    if not snapshots:
+        return []
+    with open(snapshots[-1], 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+def import_text_snapshots(store: SnapshotStore, files: List[str]):
+    """Load existing branch_images_*.txt files into the store, oldest first"""
+    for path in sorted(files):
+        match = re.search(r'(\d{8}_\d{6})', os.path.basename(path))
+        with open(path, 'r') as f:
+            urls = [line.strip() for line in f if line.strip()]
+        name = store.write(urls, match.group(1) if match else None)
+        print(f"{path}: {'stored as ' + name if name else 'unchanged, skipped'}")
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == 'import':
+        import_text_snapshots(SnapshotStore(sys.argv[2]), sys.argv[3:])
+    elif len(sys.argv) in (2, 3) and sys.argv[1] != 'import':
+        store = SnapshotStore(sys.argv[1])
+        for url in store.read(sys.argv[2] if len(sys.argv) == 3 else None):
+            print(url)
+    else:
+        print("Usage: python snapshot_store.py <store_dir> [snapshot_name]")
+        print("       python snapshot_store.py import <store_dir> <snapshot_file>...")
+        sys.exit(1)
@@ -1,18 +1,233 @@
 import os
 import sys
-from pymongo import MongoClient, UpdateOne
+import json
+import queue
+import threading
+import time
+from pymongo import MongoClient, UpdateOne, DeleteOne
+from pymongo.errors import BulkWriteError
+from pymongo.write_concern import WriteConcern
 from datetime import datetime, UTC
 import re
 from typing import Optional, List, Dict
-from urllib.parse import urlparse
+from metrics import METRICS
+from snapshot_parser import ParsedSnapshot, parse_image_url, parse_snapshot
+from snapshot_store import SnapshotStore
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_WRITERS = 4
+
+# Line fetch_branch_images writes into a success log in place of the URLs themselves
+SNAPSHOT_POINTER = re.compile(r'^Snapshot(?: unchanged)?: (\S+) in (.+)$', re.MULTILINE)
+
+# Document fields filled from IMAGE_META_FILE when image_derivatives.py has seen the image
+IMAGE_META_FIELDS = ('width', 'height', 'bytes', 'variants')
+# Fields the incremental upload compares against the last uploaded state
+TRACKED_FIELDS = ('url', 'folder') + IMAGE_META_FIELDS
+
+def load_image_meta(path: Optional[str]) -> Dict[str, Dict]:
+    """Dimensions, size and variants per code from image_meta.jsonl files written by image_derivatives.py.
+
+    path is one file or a folder of them, read in name order; later records win.
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    if os.path.isdir(path):
+        files = [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith('.jsonl')]
+    else:
+        files = [path]
+    meta = {}
+    for meta_file in files:
+        with open(meta_file, 'r') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    meta[record.pop('code')] = record
+    return meta
+
+def parse_log_file(log_file: str) -> ParsedSnapshot:
+    """Parse a URL list, or the snapshot a success log points at; a log with neither is an error"""
+    with open(log_file, 'r') as f:
+        buffer = f.read()
+    parsed = parse_snapshot(buffer)
+    if not len(parsed):
+        pointer = SNAPSHOT_POINTER.search(buffer)
+        if pointer:
+            name, store_dir = pointer.group(1), pointer.group(2).strip()
+            print(f"Reading snapshot {name} from {store_dir}")
+            parsed = parse_snapshot('\n'.join(SnapshotStore(store_dir).read(name)))
+    if not len(parsed):
+        raise ValueError(f"No image URLs in {log_file}")
+    parsed.report(log_file)
+    return parsed
+
+def with_variant_urls(meta: Dict, url: str) -> Dict:
+    """Image metadata with each variant's folder-relative path resolved against the image URL"""
+    if 'variants' not in meta:
+        return meta
+    base = url.rsplit('/', 1)[0]
+    variants = {name: dict(variant, url=f"{base}/{variant['path']}") if 'path' in variant else variant
+                for name, variant in meta['variants'].items()}
+    return {**meta, 'variants': variants}
+
+def parse_write_concern(value: Optional[str]) -> Optional[WriteConcern]:
+    """Turn '0', '1', 'majority' etc. into a WriteConcern, None keeps the client default.
+
+    With '0' writes are unacknowledged: batches are counted as submitted, not as inserted or modified.
+    """
+    if not value:
+        return None
+    return WriteConcern(w=int(value) if value.isdigit() else value)
+
+class BulkWriter:
+    """Pipelined bulk writer: the caller parses while writer threads flush batches.
+
+    Operations are partitioned by key across writers so two operations on the
+    same code are always applied by the same thread, in submission order. Each
+    writer has a bounded queue, so parsing blocks instead of buffering the
+    whole file when the cluster falls behind. Batch results feed the shared
+    metrics; the summary is printed as a JSON line.
+    """
+
+    def __init__(self, collection, batch_size: int = DEFAULT_BATCH_SIZE, writers: int = DEFAULT_WRITERS,
+                 ordered: bool = False, write_concern: Optional[WriteConcern] = None, queue_size: int = 2):
+        if write_concern is not None:
+            collection = collection.with_options(write_concern=write_concern)
+        self.collection = collection
+        self.batch_size = batch_size
+        self.ordered = ordered
+        self.buffers: List[List] = [[] for _ in range(writers)]
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(writers)]
+        self.lock = threading.Lock()
+        self.latencies: List[float] = []
+        self.totals = {'operations': 0, 'inserted': 0, 'modified': 0, 'deleted': 0, 'duplicates': 0,
+                       'unacknowledged': 0}
+        self.errors: List[Exception] = []
+        self.started = time.perf_counter()
+        self.threads = [threading.Thread(target=self._run, args=(q,), daemon=True) for q in self.queues]
+        for thread in self.threads:
+            thread.start()
+
+    def add(self, operation, key: str):
+        partition = hash(key) % len(self.buffers)
+        buffer = self.buffers[partition]
+        buffer.append(operation)
+        if len(buffer) >= self.batch_size:
+            self.queues[partition].put(buffer)
+            self.buffers[partition] = []
+
+    def _run(self, batches: queue.Queue):
+        while True:
+            batch = batches.get()
+            if batch is None:
+                return
+            # After a failure keep draining so the producer never blocks on a full queue
+            if self.errors:
+                continue
+            try:
+                self._write(batch)
+            except Exception as e:
+                with self.lock:
+                    self.errors.append(e)
+
+    def _write(self, batch: List):
+        started = time.perf_counter()
+        duplicates = unacknowledged = 0
+        try:
+            result = self.collection.bulk_write(batch, ordered=self.ordered)
+            if result.acknowledged:
+                inserted = result.upserted_count + result.inserted_count
+                modified, deleted = result.modified_count, result.deleted_count
+            else:
+                # w=0: the batch was sent but the server reports no counts
+                inserted = modified = deleted = 0
+                unacknowledged = len(batch)
+        except BulkWriteError as e:
+            # With unordered writes a code inserted concurrently is a duplicate key, not a failure
+            errors = [err for err in e.details.get('writeErrors', []) if err.get('code') != 11000]
+            if errors or self.ordered:
+                print(f"Error executing bulk write: {e}")
+                raise
+            details = e.details
+            inserted = details.get('nInserted', 0) + details.get('nUpserted', 0)
+            modified, deleted = details.get('nModified', 0), details.get('nRemoved', 0)
+            duplicates = len(details['writeErrors'])
+        latency = time.perf_counter() - started
+
+        with self.lock:
+            self.latencies.append(latency)
+            self.totals['operations'] += len(batch)
+            self.totals['inserted'] += inserted
+            self.totals['modified'] += modified
+            self.totals['deleted'] += deleted
+            self.totals['duplicates'] += duplicates
+            self.totals['unacknowledged'] += unacknowledged
+
+        METRICS.observe('phase_seconds', latency, phase='upload')
+        METRICS.inc('operations', len(batch))
+        METRICS.inc('inserted', inserted)
+        METRICS.inc('modified', modified)
+        METRICS.inc('deleted', deleted)
+        METRICS.inc('duplicates', duplicates)
+        METRICS.inc('unacknowledged', unacknowledged)
+        METRICS.advance(len(batch))
+        METRICS.detail(json.dumps({
+            'event': 'batch',
+            'operations': len(batch),
+            'inserted': inserted,
+            'modified': modified,
+            'deleted': deleted,
+            'duplicates': duplicates,
+            'unacknowledged': unacknowledged,
+            'latency_ms': round(latency * 1000, 1),
+        }))
+
+    def close(self) -> Dict:
+        """Flush remaining operations, wait for the writers and return the summary"""
+        for partition, buffer in enumerate(self.buffers):
+            if buffer:
+                self.queues[partition].put(buffer)
+            self.queues[partition].put(None)
+        for thread in self.threads:
+            thread.join()
+
+        elapsed = time.perf_counter() - self.started
+        latencies = sorted(self.latencies)
+        summary = {
+            'event': 'summary',
+            **self.totals,
+            'batches': len(latencies),
+            'elapsed_s': round(elapsed, 3),
+            'operations_per_s': round(self.totals['operations'] / elapsed, 1) if elapsed else 0.0,
+            'latency_ms_p50': round(latencies[len(latencies) // 2] * 1000, 1) if latencies else 0.0,
+            'latency_ms_max': round(latencies[-1] * 1000, 1) if latencies else 0.0,
+        }
+        print(json.dumps(summary))
+
+        if self.errors:
+            raise self.errors[0]
+        return summary
 
 class MongoDBUploader:
-    def __init__(self, connection_string: str, database_name: str = 'fgo_database'):
+    def __init__(self, connection_string: str, database_name: str = 'fgo_database',
+                 batch_size: int = DEFAULT_BATCH_SIZE, writers: int = DEFAULT_WRITERS,
+                 write_concern: Optional[WriteConcern] = None, image_meta: Optional[Dict[str, Dict]] = None):
+        # Writer threads share the client's connection pool
         self.client = MongoClient(connection_string, 
                                 serverSelectionTimeoutMS=5000,
-                                connectTimeoutMS=5000)
+                                connectTimeoutMS=5000,
+                                maxPoolSize=max(100, writers))
         self.db = self.client[database_name]
         self.collection = self.db.images
+        self.batch_size = batch_size
+        self.writers = writers
+        self.write_concern = write_concern
+        # width, height, bytes and variants per code, stored as document fields when known
+        self.image_meta = image_meta or {}
+        
+    def bulk_writer(self) -> BulkWriter:
+        return BulkWriter(self.collection, self.batch_size, self.writers, ordered=False,
+                          write_concern=self.write_concern)
         
     def create_indexes(self):
         """Create necessary indexes for better query performance"""
@@ -21,73 +236,26 @@ class MongoDBUploader:
         self.collection.create_index([("prefix", 1)])
         
     def parse_image_url(self, url: str) -> Dict:
-        """Parse image URL to extract metadata"""
-        parsed = urlparse(url)
-        path_parts = parsed.path.split('/')
-        
-        # Extract image code from filename
-        filename = path_parts[-1]
-        code = filename.replace('.jpg', '')
-        prefix = code[0]
-        number = int(code[1:])
-        
-        # Extract folder information
-        folder = '/'.join(path_parts[:-1])
-        
-        return {
-            'code': code,
-            'prefix': prefix,
-            'number': number,
-            'folder': folder,
-            'url': url
-        }
+        """Parse image URL to extract metadata, with the same pattern as the batch parser"""
+        return parse_image_url(url)
         
     def process_log_file(self, log_file: str) -> bool:
         """Process log file containing image URLs"""
         try:
-            operations = []
             current_time = datetime.now(UTC)
+            # Parse the whole file up front; malformed lines are reported and skipped
+            parsed = parse_log_file(log_file)
+            on_insert = {'$setOnInsert': {'created_at': current_time}}
             
-            with open(log_file, 'r') as f:
-                for line in f:
-                    # Skip empty lines
-                    if not line.strip():
-                        continue
-                        
-                    # Use the entire line as URL after stripping whitespace
-                    url = line.strip()
-                    
-                    # Skip if URL is empty
-                    if not url:
-                        continue
-                        
-                    metadata = self.parse_image_url(url)
-                    
-                    # Prepare update operation
-                    doc = {
-                        **metadata,
-                        'updated_at': current_time
-                    }
-                    
-                    operations.append(
-                        UpdateOne(
-                            {'code': metadata['code']},
-                            {
-                                '$set': doc,
-                                '$setOnInsert': {'created_at': current_time}
-                            },
-                            upsert=True
-                        )
-                    )
-                    
-                    # Process in batches of 1000
-                    if len(operations) >= 1000:
-                        self._execute_bulk_operations(operations)
-                        operations = []
-            
-            # Process remaining operations
-            if operations:
-                self._execute_bulk_operations(operations)
+            writer = self.bulk_writer()
+            try:
+                for doc in parsed.documents(updated_at=current_time):
+                    doc.update(with_variant_urls(self.image_meta.get(doc['code'], {}), doc['url']))
+                    writer.add(UpdateOne({'code': doc['code']}, {'$set': doc, **on_insert}, upsert=True),
+                               key=doc['code'])
+            finally:
+                # Flush remaining operations
+                writer.close()
                 
             return True
             
@@ -95,15 +263,95 @@ class MongoDBUploader:
             print(f"Error processing log file: {e}")
             return False
             
-    def _execute_bulk_operations(self, operations: List[UpdateOne]):
-        """Execute bulk write operations with error handling"""
+    def read_log_file(self, log_file: str) -> Dict[str, Dict]:
+        """Parse a log file into image metadata keyed by code"""
+        return {doc['code']: {**doc, **with_variant_urls(self.image_meta.get(doc['code'], {}), doc['url'])}
+                for doc in parse_log_file(log_file).documents()}
+        
+    def load_uploaded_state(self, manifest_file: Optional[str] = None) -> Dict[str, Dict]:
+        """Return {code: {tracked field: value}} last uploaded, from the manifest or one projection query.
+        
+        The manifest is only trusted while it lists as many codes as the
+        collection holds; after writes it did not see (another uploader, a
+        failed run, manual edits) the collection is read instead.
+        """
+        if manifest_file and os.path.exists(manifest_file):
+            with open(manifest_file, 'r') as f:
+                state = json.load(f)
+            stored = self.collection.estimated_document_count()
+            if stored == len(state):
+                return state
+            print(f"Manifest {manifest_file} lists {len(state)} codes but the collection holds {stored}, "
+                  f"reading the collection instead")
+        
+        cursor = self.collection.find({}, {'_id': 0, 'code': 1, **{field: 1 for field in TRACKED_FIELDS}})
+        return {doc['code']: {field: doc.get(field) for field in TRACKED_FIELDS} for doc in cursor}
+        
+    def save_manifest(self, manifest_file: str, images: Dict[str, Dict]):
+        """Record what was uploaded so the next run can diff without querying"""
+        state = {code: {field: meta.get(field) for field in TRACKED_FIELDS} for code, meta in images.items()}
+        temp_path = f"{manifest_file}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(state, f, sort_keys=True)
+        os.replace(temp_path, manifest_file)
+        
+    def process_log_file_incremental(self, log_file: str, manifest_file: Optional[str] = None,
+                                     delete_missing: bool = False) -> bool:
+        """Upload only the difference between a log file and the last uploaded state"""
         try:
-            result = self.collection.bulk_write(operations)
-            print(f"Processed batch: {result.upserted_count} inserted, {result.modified_count} modified")
+            current_time = datetime.now(UTC)
+            images = self.read_log_file(log_file)
+            uploaded = self.load_uploaded_state(manifest_file)
+            
+            operations = []
+            inserted = updated = deleted = 0
+            
+            for code, metadata in images.items():
+                previous = uploaded.get(code)
+                if previous is None:
+                    # An upsert, so a code written meanwhile by another uploader still gets these fields
+                    fields = {field: value for field, value in metadata.items() if field != 'code'}
+                    inserted += 1
+                else:
+                    fields = {field: metadata[field] for field in TRACKED_FIELDS
+                              if field in metadata and previous.get(field) != metadata[field]}
+                    if not fields:
+                        continue
+                    updated += 1
+                # Also covers a changed code whose document was removed since the state was read;
+                # a path may not appear in both $set and $setOnInsert
+                on_insert = {field: metadata[field] for field in ('prefix', 'number') if field not in fields}
+                operations.append((code, UpdateOne(
+                    {'code': code},
+                    {'$set': {**fields, 'updated_at': current_time},
+                     '$setOnInsert': {**on_insert, 'created_at': current_time}},
+                    upsert=True
+                )))
+            
+            if delete_missing:
+                for code in uploaded.keys() - images.keys():
+                    operations.append((code, DeleteOne({'code': code})))
+                    deleted += 1
+            
+            print(f"Change set: {inserted} new, {updated} changed, {deleted} removed, "
+                  f"{len(images) - inserted - updated} unchanged")
+            
+            writer = self.bulk_writer()
+            try:
+                for code, operation in operations:
+                    writer.add(operation, key=code)
+            finally:
+                writer.close()
+            
+            if manifest_file:
+                self.save_manifest(manifest_file, images)
+                
+            return True
+            
         except Exception as e:
-            print(f"Error executing bulk write: {e}")
-            raise
-
+            print(f"Error processing log file: {e}")
+            return False
+            
 def main():
     # Get environment variables
     mongodb_url = os.environ.get('MONGODB_URL')
@@ -122,14 +370,29 @@ def main():
         return False
         
     try:
-        # Initialize uploader
-        uploader = MongoDBUploader(mongodb_url)
+        # Initialize uploader; batching and write concern are tunable for large backfills
+        uploader = MongoDBUploader(
+            mongodb_url,
+            batch_size=int(os.environ.get('MONGODB_BATCH_SIZE', DEFAULT_BATCH_SIZE)),
+            writers=int(os.environ.get('MONGODB_WRITERS', DEFAULT_WRITERS)),
+            write_concern=parse_write_concern(os.environ.get('MONGODB_WRITE_CONCERN')),
+            image_meta=load_image_meta(os.environ.get('IMAGE_META_FILE'))
+        )
         
         # Create indexes
         uploader.create_indexes()
         
-        # Process log file
-        success = uploader.process_log_file(log_file)
+        # Process log file; UPLOAD_MODE=incremental sends only the change set
+        METRICS.start()
+        if os.environ.get('UPLOAD_MODE', 'full') == 'incremental':
+            success = uploader.process_log_file_incremental(
+                log_file,
+                manifest_file=os.environ.get('UPLOAD_MANIFEST'),
+                delete_missing=os.environ.get('UPLOAD_DELETE_MISSING') == '1'
+            )
+        else:
+            success = uploader.process_log_file(log_file)
+        METRICS.finish()
         
         return success
         
@@ -0,0 +1,52 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+
+from catalog_index import CatalogIndex, load_or_build
+from snapshot_store import SnapshotStore
+
+BASE = 'https://raw.githubusercontent.com/owner/repo/refs/heads/'
+
+def urls(*codes, branch='main', folder='images'):
+    return [f"{BASE}{branch}/{folder}/{code}.jpg" for code in codes]
+
+def test_saved_index_answers_queries(tmp_path):
+    path = str(tmp_path / 'catalog.idx')
+    CatalogIndex.build(urls('a10', 'a2', 'a7') + urls('b5', branch='extra', folder='other'), 'run1').save(path)
+
+    with CatalogIndex.load(path) as index:
+        assert index.source == 'run1'
+        assert len(index) == 4
+        assert index.prefixes() == {'a': 3, 'b': 1}
+        assert index.range('a') == [2, 7, 10]
+        assert index.count('a', 3, 10) == 2
+        assert index.range('a', 8) == [10]
+        assert index.locate('a7') == ('main', 'images')
+        assert index.locate('b5') == ('extra', 'other')
+        assert index.locate('a8') is None
+        assert 'c1' not in index
+
+def test_truncated_index_is_rebuilt(tmp_path):
+    root, path = str(tmp_path), str(tmp_path / 'catalog.idx')
+    SnapshotStore(os.path.join(root, 'store')).write(urls('a1', 'a2'), name='run1')
+    load_or_build(root, path).close()
+
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) // 2)
+
+    with load_or_build(root, path) as index:
+        assert index.range('a') == [1, 2]
+    with CatalogIndex.load(path) as index:
+        assert index.range('a') == [1, 2]
+
+def test_stale_index_is_rebuilt(tmp_path):
+    root, path = str(tmp_path), str(tmp_path / 'catalog.idx')
+    store = SnapshotStore(os.path.join(root, 'store'))
+    store.write(urls('a1', 'a2'), name='run1')
+    load_or_build(root, path).close()
+
+    store.write(urls('a1', 'a2', 'a3'), name='run2')
+    with load_or_build(root, path) as index:
+        assert 'run2' in index.source
+        assert index.range('a') == [1, 2, 3]
@@ -0,0 +1,87 @@
+import os
+import sys
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+
+from fetch_engine import CircuitOpen, FetchEngine, RetryExhausted, RetryPolicy, TransientError
+
+URL = 'https://example.test/image.jpg'
+
+class Reply:
+    """Just enough of a requests.Response for the retry logic"""
+
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = requests.structures.CaseInsensitiveDict(headers or {})
+
+    def close(self):
+        pass
+
+def engine_replying(*statuses, **policy):
+    """Engine whose session answers with the given statuses in turn, recording each call"""
+    policy.setdefault('backoff_base', 0)
+    engine = FetchEngine(concurrency=2, rate_limit=0, retry=RetryPolicy(**policy))
+    replies = list(statuses)
+    engine.calls = []
+
+    def request(method, url, **kwargs):
+        engine.calls.append(url)
+        status = replies.pop(0)
+        return status if isinstance(status, Reply) else Reply(status)
+
+    engine.session.request = request
+    return engine
+
+def test_server_error_is_retried_until_success():
+    engine = engine_replying(503, 502, 200)
+    assert engine.get(URL).status_code == 200
+    assert len(engine.calls) == 3
+
+def test_client_error_is_not_retried():
+    engine = engine_replying(404)
+    assert engine.get(URL).status_code == 404
+    assert len(engine.calls) == 1
+
+def test_retries_run_out():
+    engine = engine_replying(*[503] * 3, retries=2)
+    with pytest.raises(RetryExhausted):
+        engine.get(URL)
+    assert len(engine.calls) == 3
+
+def test_long_retry_after_fails_fast():
+    engine = engine_replying(Reply(429, {'Retry-After': '120'}), retries=3, max_wait=10)
+    with pytest.raises(RetryExhausted):
+        engine.get(URL)
+    assert len(engine.calls) == 1
+
+def test_breaker_opens_after_consecutive_failures():
+    engine = engine_replying(*[503] * 4, retries=1, breaker_threshold=4, breaker_cooldown=60)
+    for _ in range(2):
+        with pytest.raises(RetryExhausted):
+            engine.get(URL)
+
+    with pytest.raises(CircuitOpen):
+        engine.get(URL)
+    assert len(engine.calls) == 4
+
+def test_rate_limits_do_not_open_breaker():
+    limited = [Reply(403, {'X-RateLimit-Remaining': '0', 'Retry-After': '0'}) for _ in range(4)]
+    engine = engine_replying(*limited, 200, retries=4, breaker_threshold=2, breaker_cooldown=60)
+    assert engine.get(URL).status_code == 200
+    assert len(engine.calls) == 5
+
+def test_map_retries_transient_failures_in_later_rounds():
+    attempts = {}
+
+    def fetch(item):
+        attempts[item] = attempts.get(item, 0) + 1
+        if item == 'flaky' and attempts[item] == 1 or item == 'down':
+            raise TransientError(item)
+        return item.upper()
+
+    engine = FetchEngine(concurrency=2, rate_limit=0, retry=RetryPolicy(rounds=2))
+    assert engine.map(fetch, ['ok', 'flaky', 'down']) == ['OK', 'FLAKY', None]
+    assert attempts == {'ok': 1, 'flaky': 2, 'down': 3}
@@ -0,0 +1,65 @@
+import hashlib
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+
+from pack_file import INDEX_MAGIC, RECORD, PackReader, PackWriter, count, pack_paths
+
+def test_round_trip_keeps_bytes_and_hashes(tmp_path):
+    path = str(tmp_path / 'images.pack')
+    writer = PackWriter(path)
+    writer.add('a1', b'first image')
+    source = tmp_path / 'a2.jpg'
+    source.write_bytes(b'second image' * 1000)
+    writer.add_file('a2', str(source))
+    writer.close()
+
+    assert count(path) == 2
+    with PackReader(path) as reader:
+        assert reader.codes() == ['a1', 'a2']
+        assert bytes(reader.get('a1')) == b'first image'
+        assert bytes(reader.get('a2')) == b'second image' * 1000
+        assert reader.sha256('a2') == hashlib.sha256(b'second image' * 1000).hexdigest()
+        assert reader.verify() == []
+
+def test_writer_repairs_torn_tail_before_appending(tmp_path):
+    path = str(tmp_path / 'images.pack')
+    pack_path, index_path = pack_paths(path)
+    writer = PackWriter(path)
+    writer.add('a1', b'one')
+    writer.add('a2', b'two')
+    writer.close()
+
+    # A crash mid-add: blob bytes with no record, then half an index record
+    with open(pack_path, 'ab') as f:
+        f.write(b'orphaned blob')
+    with open(index_path, 'ab') as f:
+        f.write(RECORD.pack(b'a9', 6, 13, b'\0' * 32)[:RECORD.size // 2])
+
+    writer = PackWriter(path)
+    assert os.path.getsize(pack_path) == 6
+    assert os.path.getsize(index_path) == len(INDEX_MAGIC) + 2 * RECORD.size
+    writer.add('a3', b'three')
+    writer.close()
+
+    with PackReader(path) as reader:
+        assert reader.codes() == ['a1', 'a2', 'a3']
+        assert bytes(reader.get('a3')) == b'three'
+        assert reader.verify() == []
+
+def test_record_past_pack_end_is_dropped(tmp_path):
+    path = str(tmp_path / 'images.pack')
+    pack_path, _ = pack_paths(path)
+    writer = PackWriter(path)
+    writer.add('a1', b'one')
+    writer.add('a2', b'two')
+    writer.close()
+
+    # The index record landed but the pack lost its blob
+    os.truncate(pack_path, 4)
+
+    PackWriter(path).close()
+    with PackReader(path) as reader:
+        assert reader.codes() == ['a1']
+    assert os.path.getsize(pack_path) == 3
@@ -0,0 +1,37 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+
+from range_planner import COLD, UNKNOWN, History, plan, unscanned
+
+def covered(shards):
+    return {number for shard in shards for number in range(shard['start'], shard['end'] + 1)}
+
+def test_window_starting_mid_bucket_scans_unprobed_codes():
+    history = History(bucket_size=100)
+    # A branch ending at 91574 covers most of bucket 915, but none of the window's part of it
+    history.all_probed.add((91074, 91574))
+
+    assert history.classify('s', 915) == COLD
+    assert history.classify('s', 915, 91582, 91599) == UNKNOWN
+
+    shards = plan(history, 91582, 92082, prefixes='s', rotation=0)
+    assert covered(shards) == set(range(91582, 92083))
+
+def test_probed_overlap_is_still_sampled():
+    history = History(bucket_size=100)
+    history.all_probed.add((91500, 91599))
+
+    assert history.classify('s', 915, 91582, 91599) == COLD
+    shards = plan(history, 91582, 91599, prefixes='s', rotation=0)
+    assert len(covered(shards)) == 10
+
+def test_unscanned_skips_spans_crawled_with_valid_logging():
+    history = History(bucket_size=100)
+    history.scanned['s'].update({(1000, 1249), (1200, 1299), (1400, 1600)})
+
+    assert unscanned(history, 1000, 1500, prefixes='st') == [
+        {'prefix': 's', 'start': 1300, 'end': 1399},
+        {'prefix': 't', 'start': 1000, 'end': 1500},
+    ]
@@ -0,0 +1,51 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+
+from snapshot_store import FULL_EVERY, SnapshotStore, parse_url
+
+BASE = 'https://raw.githubusercontent.com/owner/repo/refs/heads/'
+
+def urls(*codes, branch='main', base=BASE):
+    return [f"{base}{branch}/images/{code}.jpg" for code in codes]
+
+def test_deltas_rebuild_every_snapshot(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    runs = [
+        urls('a1', 'a2', 'a3'),
+        urls('a1', 'a2', 'a3', 'a4'),
+        urls('a1', 'a3', 'a4'),
+        urls('a1', 'a3', 'a4') + urls('b1', branch='extra'),
+    ]
+    names = [store.write(run, name=f"run{i}") for i, run in enumerate(runs)]
+
+    assert [snapshot['kind'] for snapshot in store.index] == ['full', 'delta', 'delta', 'delta']
+    # Reopen so every read rebuilds from the files on disk
+    store = SnapshotStore(str(tmp_path))
+    for name, run in zip(names, runs):
+        assert sorted(store.read(name)) == sorted(run)
+    assert sorted(store.read()) == sorted(runs[-1])
+
+def test_unchanged_run_writes_nothing(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    assert store.write(urls('a1', 'a2'), name='first') == 'first'
+    assert store.write(list(reversed(urls('a1', 'a2'))), name='second') is None
+    assert store.snapshots() == ['first']
+
+def test_full_snapshot_bounds_delta_chain(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    for i in range(FULL_EVERY + 1):
+        store.write(urls(*(f"a{n}" for n in range(i + 1))), name=f"run{i:02d}")
+
+    kinds = [snapshot['kind'] for snapshot in store.index]
+    assert kinds == ['full'] + ['delta'] * (FULL_EVERY - 1) + ['full']
+    assert len(store.read()) == FULL_EVERY + 1
+
+def test_mirror_hosts_round_trip(tmp_path):
+    base = 'http://127.0.0.1:8000/owner/repo/refs/heads/'
+    assert parse_url(f"{base}main/images/a1.jpg") == (base, ('main', 'images', 'a1'))
+
+    store = SnapshotStore(str(tmp_path))
+    store.write(urls('a1', 'a2', base=base), name='mirror')
+    assert sorted(store.read('mirror')) == urls('a1', 'a2', base=base)